@@ -0,0 +1,221 @@
+"""This Python module contains a set of functions to generate synthetic measurement logs and to time the processing
+stages on them, so that the scaling of the processing pipeline can be measured"""
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import datetime
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+from func_classes import PointGrid
+from func_data import create_calibration_table
+from func_monitor import monitor
+
+SURREY_DATE_FORMAT = '%d/%m/%Y %H:%M:%S'
+DENSITY_COLUMNS = ['Thermistor (degC)', 'P_atmos (Pa)', 'Rel. Humidity (%)', 'Density (kg/m^3)', 'Dew point (degC)',
+                   'Pressure alt. (m)', 'Density alt. (m)', 'Env. sensor temp. (degC)', 'w_x (dps)', 'w_y (dps)',
+                   'w_z (dps)', 'a_x (g)', 'a_y (g)', 'a_z (g)', 'Inl. sensor temp. (degC)', 'Stale sample']
+
+
+def utc_time(epoch):  # the logs are read as naive times, which the processing treats as utc
+    return datetime.datetime.fromtimestamp(epoch, tz=datetime.timezone.utc)
+
+
+# -------------------- functions for generating synthetic logs  -------------------- #
+
+def write_surrey_log(file_location, start_epoch, times, columns, precision=4, block_size=50000):
+    start_time = utc_time(start_epoch).strftime(SURREY_DATE_FORMAT)
+    names = list(columns)
+    with open(file_location, 'w', newline='') as file:
+        file.write('\t'.join(['Record start time', 't (s)'] + names) + '\r\n')
+        file.write('\t' * (len(names) + 1) + '\r\n')                # blank second line of the scanner software
+        row_format = start_time + '\t%r' + f'\t%.{int(precision)}f' * len(names) + '\r\n'
+        for start in range(0, len(times), block_size):              # format each block of rows in one operation
+            block = np.column_stack([np.round(times[start:start + block_size], 6)] +
+                                    [columns[name][start:start + block_size] for name in names])
+            file.write(row_format * len(block) % tuple(block.flatten().tolist()))
+    return file_location
+
+
+def traverse_coordinates(grid, length=(400, 600), margin=(10, 10)):  # raster of probe locations, x varies fastest
+    coord_x = np.round(np.linspace(margin[0], length[0] - margin[0], grid[0]), 2)
+    coord_z = np.round(np.linspace(margin[1], length[1] - margin[1], grid[1]), 2)
+    return np.tile(coord_x, len(coord_z)), np.repeat(coord_z, len(coord_x))
+
+
+def synthesise_probe_pressures(df_calibration, n_points, point_indices, channels, seed=0, turbulence=0.03, noise=0.5):
+    pressure_labels = [label[0] for label in df_calibration.columns if label[1] == '(Pa)']
+    if channels < len(pressure_labels):
+        raise ValueError(f"at least {len(pressure_labels)} channels are required for the multi-hole probe")
+    random = np.random.default_rng(seed)
+    pitch, yaw = np.array(df_calibration['pitch']).flatten(), np.array(df_calibration['yaw']).flatten()
+    candidates = np.where((np.abs(pitch) <= 30) & (np.abs(yaw) <= 30))[0]  # typical flow angles in a test section
+    rows = random.choice(candidates, n_points)
+    dynamic_scale = (random.uniform(8, 16, n_points) / np.array(df_calibration['velocity_mag']).flatten()[rows]) ** 2
+    point_pressures = np.array(df_calibration[pressure_labels]).astype(float)[rows] * dynamic_scale[:, None]
+
+    n_samples = len(point_indices)
+    pressures = np.empty((n_samples, channels), dtype=float)
+    gusts = 1 + turbulence * random.standard_normal(n_samples)     # velocity fluctuations act on all holes
+    pressures[:, 0:len(pressure_labels)] = point_pressures[point_indices] * gusts[:, None] ** 2
+    pressures[:, len(pressure_labels):] = 0                         # further scanner channels are not connected
+    pressures += noise * random.standard_normal(pressures.shape)
+    return pressures
+
+
+def write_pressure_log(file_location, start_epoch, pressures, sample_rate):
+    times = np.arange(pressures.shape[0]) / sample_rate
+    columns = {f'P{channel} (Pa)': pressures[:, channel] for channel in range(pressures.shape[1])}
+    return write_surrey_log(file_location, start_epoch, times, columns, precision=4)
+
+
+def write_density_log(file_location, start_epoch, duration, density_rate=1, seed=0):
+    random = np.random.default_rng(seed)
+    times = np.arange(int(duration * density_rate)) / density_rate
+    drift = np.linspace(0, 1, len(times))
+    columns = {name: np.zeros(len(times)) for name in DENSITY_COLUMNS}
+    columns['Thermistor (degC)'] = 17 + 2 * drift + 0.05 * random.standard_normal(len(times))
+    columns['P_atmos (Pa)'] = 101325 - 50 * drift
+    columns['Rel. Humidity (%)'] += 35
+    columns['Density (kg/m^3)'] = 1.2 - 0.008 * drift + 0.0005 * random.standard_normal(len(times))
+    columns['Env. sensor temp. (degC)'] += 20
+    columns['Inl. sensor temp. (degC)'] += 19
+    return write_surrey_log(file_location, start_epoch, times, columns, precision=4)
+
+
+def printer_log_lines(start_epoch, probe_x, probe_z, sampling_time, lead_time, new_format=True):
+    print_times = lead_time + np.arange(len(probe_x)) * sampling_time
+    lines = [(0.0, 'Connecting...'), (0.0, 'Printer is now online.'),
+             (0.0, f"Print started at: {utc_time(start_epoch).strftime('%H:%M:%S')}"),
+             (0.5, f'echo:Unknown command: "sampling time = {sampling_time}"')]
+    for print_time, x, z in zip(print_times, probe_x, probe_z):
+        hours, minutes, seconds = int(print_time // 3600), int(print_time % 3600 // 60), int(print_time % 60)
+        clock = (f'{hours}h ' if hours > 0 else '') + (f'{minutes}m ' if hours + minutes > 0 else '') + f'{seconds}s'
+        lines.append((print_time, f'//action:notification {clock}'))
+        lines.append((print_time + 0.003, f'echo:Print time: {clock}'))
+        lines.append((print_time + 0.010, f'echo:Unknown command: "X = {x}, Z = {z}"'))
+    lines.append((print_times[-1] + sampling_time, 'Print ended'))
+    if new_format is False:                                         # the old logs carry no time stamps
+        return [text for _, text in lines]
+    stamped = list()
+    for offset, text in lines:
+        stamp = utc_time(start_epoch + offset).strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
+        stamped.append(f'{stamp} - {text}')
+    return stamped
+
+
+def write_printer_log(file_location, start_epoch, probe_x, probe_z, sampling_time, lead_time, new_format=True):
+    lines = printer_log_lines(start_epoch, probe_x, probe_z, sampling_time, lead_time, new_format)
+    with open(file_location, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    return file_location
+
+
+def generate_measurement(directory, df_calibration, duration, sample_rate, channels, grid, density_rate=1, seed=0,
+                         lead_time=5.0, start_epoch=1644705973.0):  # synthetic scanner and printer logs of one run
+    os.makedirs(directory, exist_ok=True)
+    probe_x, probe_z = traverse_coordinates(grid)
+    sampling_time = round((duration - lead_time) / len(probe_x), 3)
+    if sampling_time <= 4:                                          # log_printer_to_csv trims up to 4 s per point
+        raise ValueError(f"a duration of {duration} s leaves only {sampling_time} s at each point of a "
+                         f"{grid[0]} by {grid[1]} traverse")
+    n_samples = int(duration * sample_rate)
+    point_indices = np.clip(((np.arange(n_samples) / sample_rate - lead_time) // sampling_time).astype(int),
+                            0, len(probe_x) - 1)                    # traverse point held at each sample
+    pressures = synthesise_probe_pressures(df_calibration, len(probe_x), point_indices, channels, seed)
+    logs = {'pressure': write_pressure_log(os.path.join(directory, 'log_pressure.txt'), start_epoch, pressures,
+                                           sample_rate),
+            'density': write_density_log(os.path.join(directory, 'log_additional.txt'), start_epoch, duration,
+                                         density_rate, seed),
+            'printer_new': write_printer_log(os.path.join(directory, 'log_printer.txt'), start_epoch, probe_x,
+                                             probe_z, sampling_time, lead_time, True),
+            'printer_old': write_printer_log(os.path.join(directory, 'log_printer_old.txt'), start_epoch, probe_x,
+                                             probe_z, sampling_time, lead_time, False)}
+    return logs
+
+
+def calibration_table_from_surface(surface, interp_size):  # search index at a given resolution without a table file
+    grid = PointGrid(surface.pitch_limits, surface.yaw_limits, interp_size)
+    xy_grid = grid.xy_interpolated
+    columns = {('yaw', '(deg)'): xy_grid[:, 1], ('pitch', '(deg)'): xy_grid[:, 0]}
+    names = ['c_p_total', 'c_p_static'] + surface.c_p_labels
+    data_pivots = surface.evaluate_grid_channels(grid.x_coord, grid.y_coord, names)
+    for channel, name in enumerate(names):
+        columns[name, '(ratio)'] = data_pivots[:, :, channel].flatten()
+    return create_calibration_table(pd.DataFrame(columns))
+
+
+# -------------------- functions for timing and reporting  -------------------- #
+
+class StageTimer:  # Time consecutive processing stages and keep the fastest of several repeats
+    def __init__(self, quiet=True):
+        self.quiet = quiet
+        self.stages = dict()
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        output = io.StringIO() if self.quiet else sys.stdout        # stage functions report a lot of progress
+        time_start = time.perf_counter()
+        with contextlib.redirect_stdout(output), monitor.stage(name, rows) as record:
+            yield
+        seconds = time.perf_counter() - time_start
+        peak = None if record['peak'] is None else round(record['peak'], 1)
+        if name not in self.stages or seconds < self.stages[name]['seconds']:
+            self.stages[name] = {'seconds': seconds, 'rows': rows, 'peak_rss_mb': peak,
+                                 'rows_per_second': None if rows is None else rows / max(seconds, 1e-9)}
+
+
+def environment_summary():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'commit': commit}
+
+
+def find_previous_results(directory, exclude=None):
+    names = sorted(name for name in os.listdir(directory) if name.startswith('benchmark_') and name.endswith('.json'))
+    names = [name for name in names if os.path.join(directory, name) != exclude]
+    return os.path.join(directory, names[-1]) if len(names) > 0 else None
+
+
+def export_benchmark_results(results, directory):
+    os.makedirs(directory, exist_ok=True)
+    file_name = os.path.join(directory, f"benchmark_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(file_name, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"successfully exported benchmark results to {file_name}")
+    return file_name
+
+
+def compare_benchmark_results(results, previous_location, threshold=1.2, min_seconds=0.05):  # ratios to a previous run
+    with open(previous_location, 'r') as file:
+        previous = json.load(file)
+    previous_cases = {case['name']: case for case in previous['cases']}
+    print(f"comparison with {previous_location} (commit {previous['environment'].get('commit')})")
+    regressions = list()
+    for case in results['cases']:
+        if case['name'] not in previous_cases:
+            continue
+        for stage, timing in case['stages'].items():
+            previous_timing = previous_cases[case['name']]['stages'].get(stage)
+            if previous_timing is None:
+                continue
+            ratio = timing['seconds'] / max(previous_timing['seconds'], 1e-9)
+            slower = ratio > threshold and timing['seconds'] - previous_timing['seconds'] > min_seconds
+            flag = 'SLOWER' if slower else ''
+            print(f"    {case['name']:<24}{stage:<38}{previous_timing['seconds']:>9.3f} s {timing['seconds']:>9.3f} s "
+                  f"{ratio:>7.2f}x {flag}")
+            if slower:
+                regressions.append((case['name'], stage, ratio))
+    return regressions
+
+# end of code
@@ -1,5 +1,18 @@
+import os
+import json
+import pickle
 import numpy as np
 import math as math
+from scipy.spatial import cKDTree
+from scipy.interpolate import RectBivariateSpline, make_interp_spline
+from func_monitor import ProgressReporter
+
+
+def interpolate_grid_channels(x_in, y_in, data_pivots, x_out, y_out, method='cubic'):
+    # tensor-product spline through stacked [y, x, channel] pivot tables, evaluated on the x_out by y_out raster
+    degree = {'linear': 1, 'cubic': 3}[method]
+    data_along_x = make_interp_spline(x_in, data_pivots, k=degree, axis=1)(x_out)      # all rows and channels at once
+    return make_interp_spline(y_in, data_along_x, k=degree, axis=0)(y_out)
 
 
 class PointGrid:
@@ -7,7 +20,7 @@ class PointGrid:
         x_array, y_array = np.array(x_array), np.array(y_array)
         x_min = float(min(x_array))
         x_max = float(max(x_array))
-        y_mior = float(min(y_array))
+        y_min = float(min(y_array))
         y_max = float(max(y_array))
         self.n_rows = int(math.ceil(y_max - y_min) / cell_size) + 1
         self.n_columns = int(math.ceil((x_max - x_min) / cell_size)) + 1
@@ -19,9 +32,16 @@ class PointGrid:
         y_max = y_min + (self.n_rows * cell_size) - cell_size       # new maximum y-coordinate in raster
         self.x_coord = np.linspace(x_min, x_max, self.n_columns)    # generate x-coordinate of cell centres
         self.y_coord = np.linspace(y_min, y_max, self.n_rows)       # generate y-coordinate of cell centres
-        tile = np.tile(self.x_coord, self.n_rows)
-        repeat = np.repeat(self.y_coord, self.n_columns)
-        self.xy_interpolated = np.column_stack((tile, repeat))  # xy array
+
+    @property
+    def xy_interpolated(self):  # xy array of all raster points, only built when requested
+        return self.xy_rows(0, self.n_rows)
+
+    def xy_rows(self, row_start, row_end):  # xy array of a block of raster rows (x varies fastest)
+        y_coord = self.y_coord[row_start:row_end]
+        tile = np.tile(self.x_coord, len(y_coord))
+        repeat = np.repeat(y_coord, self.n_columns)
+        return np.column_stack((tile, repeat))
 
 
 class GraphBundle:  # Sort dimensionless parameter values into a pivot table for graphing
@@ -49,3 +69,171 @@ class GraphBundle:  # Sort dimensionless parameter values into a pivot table for
         self.norm_factor = float(1)
         self.normalise = False
         self.normalised_limits = [None, None]
+
+
+def load_calibration_table(cache_location):  # memory-map a cached calibration table, so processes share its pages
+    with open(os.path.join(cache_location, 'table.json'), 'r') as file:
+        meta = json.load(file)
+    angles = np.load(os.path.join(cache_location, 'angles.npy'), mmap_mode='r')
+    c_p_locals = np.load(os.path.join(cache_location, 'c_p_locals.npy'), mmap_mode='r')
+    sectors = np.load(os.path.join(cache_location, 'sectors.npy'), mmap_mode='r')
+    with open(os.path.join(cache_location, 'index.pkl'), 'rb') as file:
+        sector_trees = pickle.load(file)
+    return CalibrationTable(angles[0], angles[1], angles[2], angles[3], c_p_locals, meta['c_p_labels'], sectors,
+                            sector_trees, cache_location)
+
+
+class CalibrationTable:  # Interpolated calibration data with one search index per dominant port (sector)
+    def __init__(self, pitch, yaw, c_p_static, c_p_total, c_p_locals, c_p_labels, sectors=None, sector_trees=None,
+                 cache_location=None):
+        self.pitch = np.asarray(pitch, dtype=float).ravel()         # asarray keeps memory-mapped arrays mapped
+        self.yaw = np.asarray(yaw, dtype=float).ravel()
+        self.c_p_static = np.asarray(c_p_static, dtype=float).ravel()
+        self.c_p_total = np.asarray(c_p_total, dtype=float).ravel()
+        self.c_p_locals = np.ascontiguousarray(c_p_locals, dtype=float)
+        self.c_p_labels = list(c_p_labels)
+        self.n_points, self.n_holes = self.c_p_locals.shape
+        resolution_pitch = abs(self.pitch[1] - self.pitch[2])
+        resolution_yaw = abs(self.yaw[1] - self.yaw[2])
+        self.resolution = max(resolution_pitch, resolution_yaw)
+        self.unique_pitch = np.unique(self.pitch)
+        self.unique_yaw = np.unique(self.yaw)
+        self.n_pitch, self.n_yaw = len(self.unique_pitch), len(self.unique_yaw)
+        self.grid_regular = bool(self.n_points == self.n_pitch * self.n_yaw                 # yaw-major raster
+                                 and np.array_equal(self.pitch, np.tile(self.unique_pitch, self.n_yaw))
+                                 and np.array_equal(self.yaw, np.repeat(self.unique_yaw, self.n_pitch)))
+        if sectors is None:                                         # the hole reading the highest pressure
+            sectors = np.argmin(self.c_p_locals, axis=1)
+        self.sectors = np.asarray(sectors, dtype=int).ravel()
+        self.sector_members = self.group_by_sector(self.sectors)
+        self.sector_trees = sector_trees
+        if self.sector_trees is None:                               # build the search indices only once
+            self.sector_trees = [cKDTree(self.c_p_locals[members]) if len(members) > 0 else None
+                                 for members in self.sector_members]
+        self.cache_location = cache_location                        # set once the table is stored on disk
+
+    def __reduce_ex__(self, protocol):  # other processes map a cached table from disk instead of receiving a copy
+        if self.cache_location is None:
+            return super().__reduce_ex__(protocol)
+        return load_calibration_table, (self.cache_location,)
+
+    def group_by_sector(self, sectors):  # indices belonging to each sector, in a single sort
+        order = np.argsort(sectors, kind='stable')
+        bounds = np.searchsorted(sectors[order], np.arange(self.n_holes + 1))
+        return [order[bounds[sector]:bounds[sector + 1]] for sector in range(self.n_holes)]
+
+    def query(self, c_p_experiment):  # find the closest calibration point for all samples, sector by sector
+        c_p_experiment = np.asarray(c_p_experiment, dtype=float)
+        n_samples = c_p_experiment.shape[0]
+        indices, distances = np.zeros(n_samples, dtype=int), np.full(n_samples, np.inf)
+        dominant = np.argmin(c_p_experiment, axis=1)
+        for sector, rows in enumerate(self.group_by_sector(dominant)):
+            if self.sector_trees[sector] is None or len(rows) == 0:
+                continue
+            distance, index = self.sector_trees[sector].query(c_p_experiment[rows], k=1)
+            indices[rows], distances[rows] = self.sector_members[sector][index], distance
+
+        own = c_p_experiment[np.arange(n_samples), dominant]
+        for sector, tree in enumerate(self.sector_trees):           # other sectors can only be closer near their edge
+            if tree is None:
+                continue
+            bound = (c_p_experiment[:, sector] - own) / np.sqrt(2)  # distance to the points where this port dominates
+            rows = np.where((dominant != sector) & (bound <= distances))[0]
+            if len(rows) == 0:
+                continue
+            distance, index = tree.query(c_p_experiment[rows], k=1,
+                                         distance_upper_bound=np.nextafter(np.amax(distances[rows]), np.inf))
+            closer = distance < distances[rows]
+            indices[rows[closer]] = self.sector_members[sector][index[closer]]
+            distances[rows[closer]] = distance[closer]
+        return indices, distances ** 2                              # squared distance, as in closest_match_euclidean
+
+    def query_window(self, c_p_experiment, pitch_min, pitch_max, yaw_min, yaw_max, chunk_size=None):
+        c_p_experiment = np.asarray(c_p_experiment, dtype=float)
+        n_samples = c_p_experiment.shape[0]
+        indices = np.zeros(n_samples, dtype=int)
+        distances = np.zeros(n_samples, dtype=float)
+        if not self.grid_regular:                                   # brute force search within irregular tables
+            print("calibration table is not a regular grid, searching each window separately")
+            progress = ProgressReporter("searching calibration windows", n_samples, 'samples')
+            for row, c_p_point in enumerate(c_p_experiment):
+                valid_indices = np.where((self.yaw > yaw_min[row]) & (self.yaw < yaw_max[row]) &
+                                         (self.pitch > pitch_min[row]) & (self.pitch < pitch_max[row]))[0]
+                if len(valid_indices) == 0:
+                    raise ValueError(f"no calibration point lies inside the search window of sample {row} (pitch "
+                                     f"{pitch_min[row]} to {pitch_max[row]}, yaw {yaw_min[row]} to {yaw_max[row]})")
+                match_array = np.sum((c_p_point - self.c_p_locals[valid_indices]) ** 2, axis=1)
+                closest_match_idx = np.argmin(match_array)
+                indices[row] = valid_indices[closest_match_idx]
+                distances[row] = match_array[closest_match_idx]
+                progress.update()
+            progress.close()
+            return indices, distances
+
+        pitch_lo = np.searchsorted(self.unique_pitch, pitch_min, side='right')    # first grid index inside window
+        pitch_hi = np.searchsorted(self.unique_pitch, pitch_max, side='left')     # first grid index after window
+        yaw_lo = np.searchsorted(self.unique_yaw, yaw_min, side='right')
+        yaw_hi = np.searchsorted(self.unique_yaw, yaw_max, side='left')
+        window_pitch = max(int(np.amax(pitch_hi - pitch_lo)), 1)                  # largest window in the batch
+        window_yaw = max(int(np.amax(yaw_hi - yaw_lo)), 1)
+        steps_pitch, steps_yaw = np.arange(window_pitch), np.arange(window_yaw)
+        if chunk_size is None or chunk_size < 1:
+            chunk_size = n_samples
+        progress = ProgressReporter("searching calibration windows", n_samples, 'samples')
+        for start in range(0, n_samples, chunk_size):               # chunks cap the memory of the gathered windows
+            end = min(start + chunk_size, n_samples)
+            pitch_idx = pitch_lo[start:end, None] + steps_pitch
+            yaw_idx = yaw_lo[start:end, None] + steps_yaw
+            valid_yaw = yaw_idx < yaw_hi[start:end, None]
+            valid_pitch = pitch_idx < pitch_hi[start:end, None]
+            valid = (valid_yaw[:, :, None] & valid_pitch[:, None, :]).reshape(end - start, -1)
+            empty = np.flatnonzero(~valid.any(axis=1))              # argmin would return an invalid point
+            if len(empty) > 0:
+                row = start + empty[0]
+                raise ValueError(f"no calibration point lies inside the search window of {len(empty)} samples, e.g. "
+                                 f"sample {row} (pitch {pitch_min[row]} to {pitch_max[row]}, yaw {yaw_min[row]} "
+                                 f"to {yaw_max[row]})")
+            pitch_idx = np.minimum(pitch_idx, self.n_pitch - 1)
+            yaw_idx = np.minimum(yaw_idx, self.n_yaw - 1)
+            flat_idx = (yaw_idx[:, :, None] * self.n_pitch + pitch_idx[:, None, :]).reshape(end - start, -1)
+            match_array = np.sum((c_p_experiment[start:end, None, :] - self.c_p_locals[flat_idx]) ** 2, axis=2)
+            match_array[~valid] = np.inf
+            closest_match_idx = np.argmin(match_array, axis=1)
+            rows = np.arange(end - start)
+            indices[start:end] = flat_idx[rows, closest_match_idx]
+            distances[start:end] = match_array[rows, closest_match_idx]
+            progress.update(end - start)
+        progress.close()
+        return indices, distances
+
+
+class CalibrationSurface:  # Spline surfaces of calibration coefficients over a regular pitch/yaw grid
+    def __init__(self, unique_pitch, unique_yaw, channels, degree=3, units=None):
+        self.unique_pitch = np.asarray(unique_pitch, dtype=float)
+        self.unique_yaw = np.asarray(unique_yaw, dtype=float)
+        self.pitch_limits = [self.unique_pitch[0], self.unique_pitch[-1]]
+        self.yaw_limits = [self.unique_yaw[0], self.unique_yaw[-1]]
+        self.method = {1: 'linear', 3: 'cubic'}[degree]
+        self.names = list(channels)
+        self.pivots = np.stack([channels[name] for name in self.names], axis=2)    # indexed [yaw, pitch, channel]
+        self.splines = dict()           # the same splines per channel, for point queries and their derivatives
+        for name, pivot in channels.items():
+            self.splines[name] = RectBivariateSpline(self.unique_yaw, self.unique_pitch, pivot, kx=degree, ky=degree)
+        self.c_p_labels = [name for name in self.names if 'c_p_local' in name]
+        self.units = {name: '(ratio)' for name in self.names} if units is None else dict(units)
+
+    def evaluate(self, name, pitch, yaw, d_pitch=0, d_yaw=0):  # evaluate a surface (or derivative) at many points
+        return self.splines[name].ev(yaw, pitch, dx=d_yaw, dy=d_pitch)
+
+    def evaluate_grid_channels(self, pitch, yaw, names=None):  # all surfaces on a raster, indexed [yaw, pitch, channel]
+        pivots = self.pivots if names is None else self.pivots[:, :, [self.names.index(name) for name in names]]
+        return interpolate_grid_channels(self.unique_pitch, self.unique_yaw, pivots, pitch, yaw, self.method)
+
+    def evaluate_grid(self, name, pitch, yaw):  # evaluate a surface on a raster, indexed [yaw, pitch]
+        return self.evaluate_grid_channels(pitch, yaw, [name])[:, :, 0]
+
+    def evaluate_c_p_locals(self, pitch, yaw, d_pitch=0, d_yaw=0):
+        c_p_locals = np.empty((len(pitch), len(self.c_p_labels)), dtype=float)
+        for column, name in enumerate(self.c_p_labels):
+            c_p_locals[:, column] = self.evaluate(name, pitch, yaw, d_pitch, d_yaw)
+        return c_p_locals
@@ -1,24 +1,14 @@
 """This Python module contains a set of functions related to processing data measured by a range of pressure
 sensing devices"""
 
-from scipy.interpolate import interp2d
-from sklearn.neighbors import BallTree
 from scipy.spatial import cKDTree
+from concurrent.futures import ProcessPoolExecutor
+from func_classes import CalibrationTable, CalibrationSurface
+from func_monitor import monitored, ProgressReporter, fork_context
 import pandas as pd
 import numpy as np
 import datetime
-
-
-def interpolate_2d_grid(graph_bundle_raw, graph_data_interp):  # interpolation data using Delaunay triangulation
-    x_in = graph_bundle_raw.unique_x
-    y_in = graph_bundle_raw.unique_y
-    z_in = graph_bundle_raw.data_pivot
-    interpolation = interp2d(x_in, y_in, z_in, kind='cubic')
-    x_out = graph_data_interp.unique_x
-    y_out = graph_data_interp.unique_y
-    graph_data_interp.data_pivot = interpolation(x_out, y_out)
-    graph_data_interp.data = graph_data_interp.data_pivot.flatten()
-    return None
+import os
 
 
 def epoch_to_timestamp(epoch):
@@ -28,12 +18,55 @@ def epoch_to_timestamp(epoch):
     return datetime_str
 
 
+def epochs_to_timestamps(epochs):  # vectorised epoch_to_timestamp for arrays of epochs
+    epochs = np.asarray(epochs, dtype=np.float64).ravel()
+    if epochs.shape[0] == 0:
+        return np.array(list(), dtype=str)
+    seconds = np.floor(epochs)
+    micro_seconds = np.round((epochs - seconds) * 1e6).astype(np.int64)     # rounded as in datetime.fromtimestamp
+    days, milli_seconds = np.divmod(seconds.astype(np.int64) * 1000 + micro_seconds // 1000, 86400000)
+    first_day = days.min()
+    calendar = np.arange(first_day, days.max() + 1).astype('datetime64[D]').astype(object)
+    dates = np.array([day.strftime('%d/%m/%Y ') for day in calendar], dtype='S11')   # one entry per day in range
+    pairs = np.array([f'{value:02d}' for value in range(100)], dtype='S2').view(np.uint8).reshape(-1, 2)
+    clock = np.empty((86400, 9), dtype=np.uint8)                            # 'HH:MM:SS.' for every second of a day
+    second_of_day = np.arange(86400)
+    clock[:, 0:2], clock[:, 3:5] = pairs[second_of_day // 3600], pairs[second_of_day // 60 % 60]
+    clock[:, 6:8], clock[:, [2, 5]], clock[:, 8] = pairs[second_of_day % 60], ord(':'), ord('.')
+    triples = np.array([f'{value:03d}' for value in range(1000)], dtype='S3')
+    milli_seconds = milli_seconds.astype(np.int32)
+    characters = np.empty(epochs.shape[0], dtype=[('date', 'S11'), ('clock', 'S9'), ('milli', 'S3')])
+    characters['date'] = dates[days - first_day]
+    characters['clock'] = clock.view('S9').ravel()[milli_seconds // 1000]
+    characters['milli'] = triples[milli_seconds % 1000]
+    characters = characters.view(np.uint8).reshape(-1, 23)                 # 'dd/mm/YYYY HH:MM:SS.fff' as ascii
+    return characters.astype(np.uint32).view('U23').ravel()                # ascii codes are valid utf-32
+
+
 def timestamp_to_epoch(timestamp, time_format):
     utc_time = datetime.datetime.strptime(timestamp, time_format)
     epoch = (utc_time - datetime.datetime(1970, 1, 1)).total_seconds()
     return epoch
 
 
+def align_to_times(source_times, source_columns, target_times, method='hold'):  # slower log at each target time
+    source_times = np.asarray(source_times, dtype=float)
+    if method == 'linear':                                          # np.interp holds the end values outside the log
+        return [np.interp(target_times, source_times, column) for column in source_columns]
+    if method != 'hold':
+        raise ValueError(f"unknown alignment '{method}', choose 'hold' or 'linear'")
+    indices = np.clip(np.searchsorted(source_times, target_times, side='right') - 1, 0, len(source_times) - 1)
+    return [np.asarray(column)[indices] for column in source_columns]   # last reading at or before each sample
+
+
+def find_covered_samples(source_times, target_times):  # first and end target sample covered by the source log
+    source_times = np.asarray(source_times, dtype=float)
+    period = np.median(np.diff(source_times)) if len(source_times) > 1 else 0.0
+    first = int(np.searchsorted(target_times, source_times[0], side='left'))   # no reading before the log starts
+    end = int(np.searchsorted(target_times, source_times[-1] + period, side='left'))
+    return first, max(first, end)
+
+
 def flip_coordinates(coordinates):
     max_coordinate = max(coordinates)
     min_coordinate = min(coordinates)
@@ -54,6 +87,7 @@ def calculate_total_and_static_pressure(data_frame):
     data_frame['pressure_total', '(Pa)'] = pressure_total
 
 
+@monitored()
 def calculate_dimensionless_pressure(data_frame):
     print("finding relevant pressure column indices")
     pressure_labels = []
@@ -119,45 +153,56 @@ def closest_match_kd_tree(value, lookup_table):
     return closest_index, closest_entry
 
 
-def closest_match_ball_tree(value, lookup_table):
-    tree = BallTree(lookup_table)
-    _, closest_index = tree.query([value])
-    closest_entry = lookup_table[closest_index[0]]
-    return closest_index, closest_entry
+def find_c_p_labels(data_frame):
+    c_p_labels = list()
+    for index, headings in enumerate(list(data_frame.columns)):
+        if 'c_p_local' in headings[0]:
+            c_p_labels.append(headings[0])
+    return c_p_labels
+
 
+@monitored()
+def create_calibration_table(df_interpolation):
+    print("building search index over interpolated calibration data")
+    c_p_labels = find_c_p_labels(df_interpolation)
+    sectors = None
+    if 'sector' in df_interpolation.columns.get_level_values(0):  # dominant port recorded by run_interpolate
+        sectors = np.array(df_interpolation['sector']).flatten().astype(int) - 1
+    calibration = CalibrationTable(np.array(df_interpolation['pitch']), np.array(df_interpolation['yaw']),
+                                   np.array(df_interpolation['c_p_static']), np.array(df_interpolation['c_p_total']),
+                                   np.array(df_interpolation[c_p_labels]).astype(float), c_p_labels, sectors)
+    return calibration
 
+
+def find_closest_calibration_points(calibration, c_p_experiment):  # vectorised lookup for all samples at once
+    closest_match_idx, closest_match = calibration.query(c_p_experiment)
+    pitch = calibration.pitch[closest_match_idx]
+    yaw = calibration.yaw[closest_match_idx]
+    c_p_static = calibration.c_p_static[closest_match_idx]
+    c_p_total = calibration.c_p_total[closest_match_idx]
+    return pitch, yaw, c_p_static, c_p_total, closest_match
+
+
+def find_closest_calibration_points_in_window(calibration, c_p_experiment, pitch, yaw, half_width, chunk_size=None):
+    valid_idx, closest_match = calibration.query_window(c_p_experiment, pitch - half_width, pitch + half_width,
+                                                        yaw - half_width, yaw + half_width, chunk_size)
+    return (calibration.pitch[valid_idx], calibration.yaw[valid_idx], calibration.c_p_static[valid_idx],
+            calibration.c_p_total[valid_idx], closest_match)
+
+
+@monitored()
 def calculate_pitch_and_yaw(df_experiment, df_interpolation):
-    resolution_pitch = abs(df_interpolation['pitch'].iat[1, 0]-df_interpolation['pitch'].iat[2, 0])
-    resolution_yaw = abs(df_interpolation['yaw'].iat[1, 0] - df_interpolation['yaw'].iat[2, 0])
-    resolution = max(resolution_pitch, resolution_yaw)
+    calibration = df_interpolation
+    if not isinstance(calibration, CalibrationTable):
+        calibration = create_calibration_table(df_interpolation)
+    resolution = calibration.resolution
     df_experiment['resolution', '(deg)'] = np.zeros((df_experiment.shape[0], 1), dtype=float) + resolution
     print(f"interpolation resolution is {resolution}")
 
     print("determining pitch (alpha) and yaw (beta) of measured parameters")
-    c_p_labels = []
-    for index, headings in enumerate(list(df_experiment.columns)):
-        if 'c_p_local' in headings[0]:
-            c_p_labels.append(headings[0])
-    n_measurements = df_experiment.shape[0]
-    c_p_experiment = np.array(df_experiment[c_p_labels]).astype(float)
-    c_p_interpolation = np.array(df_interpolation[c_p_labels]).astype(float)
-    c_p_total, c_p_static = np.array(list()), np.array(list())
-    yaw, pitch = np.array(list()), np.array(list())
-    closest_match = np.array(list())
-
-    interpolation_c_p_static = np.array(df_interpolation['c_p_static'])
-    interpolation_c_p_total = np.array(df_interpolation['c_p_total'])
-    interpolation_pitch = np.array(df_interpolation['pitch'])
-    interpolation_yaw = np.array(df_interpolation['yaw'])
-
-    for index, c_p_point in enumerate(c_p_experiment, start=1):
-        closest_match_idx, closest_match_val = closest_match_ball_tree(c_p_point, c_p_interpolation)
-        c_p_static = np.append(c_p_static, interpolation_c_p_static[closest_match_idx])
-        c_p_total = np.append(c_p_total, interpolation_c_p_total[closest_match_idx])
-        pitch = np.append(pitch, interpolation_pitch[closest_match_idx])
-        yaw = np.append(yaw, interpolation_yaw[closest_match_idx])
-        closest_match = np.append(closest_match, closest_match_val)
-        print(f"finding point {index} of {n_measurements}")
+    c_p_experiment = np.array(df_experiment[calibration.c_p_labels]).astype(float)
+    pitch, yaw, c_p_static, c_p_total, closest_match = find_closest_calibration_points(calibration, c_p_experiment)
+    print(f"found {df_experiment.shape[0]} points")
 
     df_experiment['pitch', '(deg)'] = pitch
     df_experiment['yaw', '(deg)'] = yaw
@@ -166,52 +211,22 @@ def calculate_pitch_and_yaw(df_experiment, df_interpolation):
     df_experiment['closest_match', '(ratio)'] = closest_match
 
 
-def enhance_pitch_and_yaw(df_experiment, df_interpolation):
+@monitored()
+def enhance_pitch_and_yaw(df_experiment, df_interpolation, chunk_size=None):
     print("enhancing accuracy of pitch (alpha) and yaw (beta) of measured parameters")
-    prev_resolution = df_experiment['resolution'].iat[1, 0]
-    resolution_pitch = abs(df_interpolation['pitch'].iat[1, 0]-df_interpolation['pitch'].iat[2, 0])
-    resolution_yaw = abs(df_interpolation['yaw'].iat[1, 0] - df_interpolation['yaw'].iat[2, 0])
-    resolution = max(resolution_pitch, resolution_yaw)
+    calibration = df_interpolation
+    if not isinstance(calibration, CalibrationTable):
+        calibration = create_calibration_table(df_interpolation)
+    prev_resolution = df_experiment['resolution'].iat[0, 0]
+    resolution = calibration.resolution
     df_experiment['resolution', '(deg)'] = np.zeros((df_experiment.shape[0], 1), dtype=float) + resolution
     print(f"enhancement resolution is {resolution}")
 
-    c_p_labels = list()
-    for index, headings in enumerate(list(df_experiment.columns)):
-        if 'c_p_local' in headings[0]:
-            c_p_labels.append(headings[0])
-    n_measurements = df_experiment.shape[0]
-    c_p_experiment = np.array(df_experiment[c_p_labels]).astype(float)
-    c_p_interpolation = np.array(df_interpolation[c_p_labels]).astype(float)
-    c_p_total, c_p_static = np.array(list()), np.array(list())
-    yaw, pitch = np.array(list()), np.array(list())
-    closest_match = np.array(list())
-
-    yaw_all = np.array(df_interpolation['yaw']).flatten()
-    pitch_all = np.array(df_interpolation['pitch']).flatten()
-    yaw_min = np.array(df_experiment['yaw']).flatten() - prev_resolution
-    pitch_min = np.array(df_experiment['pitch']).flatten() - prev_resolution
-    yaw_max = np.array(df_experiment['yaw']).flatten() + prev_resolution
-    pitch_max = np.array(df_experiment['pitch']).flatten() + prev_resolution
-
-    interpolation_c_p_static = np.array(df_interpolation['c_p_static'])
-    interpolation_c_p_total = np.array(df_interpolation['c_p_total'])
-    interpolation_pitch = np.array(df_interpolation['pitch'])
-    interpolation_yaw = np.array(df_interpolation['yaw'])
-
-    for row_index, c_p_point in enumerate(c_p_experiment, start=0):
-        valid_indices = np.where((yaw_all > yaw_min[row_index]) & (yaw_all < yaw_max[row_index]) &
-                                 (pitch_all > pitch_min[row_index]) & (pitch_all < pitch_max[row_index]))[0]
-        c_p_interpolation_valid = (c_p_interpolation[valid_indices])
-        match_array = np.sum((c_p_point - c_p_interpolation_valid) ** 2, axis=1)
-        closest_match_idx = np.argmin(match_array)
-        closest_match_val = match_array[closest_match_idx]
-        valid_idx = valid_indices[closest_match_idx]
-        c_p_static = np.append(c_p_static, interpolation_c_p_static[valid_idx])
-        c_p_total = np.append(c_p_total, interpolation_c_p_total[valid_idx])
-        pitch = np.append(pitch, interpolation_pitch[valid_idx])
-        yaw = np.append(yaw, interpolation_yaw[valid_idx])
-        closest_match = np.append(closest_match, closest_match_val)
-        print(f"enhancing point {row_index + 1} of {n_measurements}")
+    c_p_experiment = np.array(df_experiment[calibration.c_p_labels]).astype(float)
+    pitch, yaw, c_p_static, c_p_total, closest_match = find_closest_calibration_points_in_window(
+        calibration, c_p_experiment, np.array(df_experiment['pitch']).flatten(),
+        np.array(df_experiment['yaw']).flatten(), prev_resolution, chunk_size)
+    print(f"enhanced {df_experiment.shape[0]} points")
 
     df_experiment['pitch', '(deg)'] = pitch
     df_experiment['yaw', '(deg)'] = yaw
@@ -220,6 +235,161 @@ def enhance_pitch_and_yaw(df_experiment, df_interpolation):
     df_experiment['closest_match', '(ratio)'] = closest_match
 
 
+def create_calibration_surface(calibration):
+    print("fitting bicubic surfaces to the calibration coefficients")
+    if not calibration.grid_regular:
+        raise ValueError("the calibration table does not form a regular pitch and yaw grid")
+    shape = (calibration.n_yaw, calibration.n_pitch)
+    channels = {'c_p_static': calibration.c_p_static.reshape(shape), 'c_p_total': calibration.c_p_total.reshape(shape)}
+    for column, label in enumerate(calibration.c_p_labels):
+        channels[label] = calibration.c_p_locals[:, column].reshape(shape)
+    return CalibrationSurface(calibration.unique_pitch, calibration.unique_yaw, channels)
+
+
+@monitored()
+def fit_calibration_surface(df_calibration, method='cubic'):  # surfaces through the original calibration points
+    print(f"fitting {method} surfaces to the calibration data")
+    unique_pitch, pitch_index = np.unique(np.array(df_calibration['pitch']).flatten(), return_inverse=True)
+    unique_yaw, yaw_index = np.unique(np.array(df_calibration['yaw']).flatten(), return_inverse=True)
+    if len(pitch_index) != len(unique_pitch) * len(unique_yaw):
+        raise ValueError("the calibration data does not form a regular pitch and yaw grid")
+    names = ['velocity_mag', 'density', 'c_p_total', 'c_p_static'] + find_c_p_labels(df_calibration)
+    channels, units = dict(), dict()
+    for name in names:
+        channels[name] = np.zeros((len(unique_yaw), len(unique_pitch)), dtype=float)
+        channels[name][yaw_index, pitch_index] = np.array(df_calibration[name]).flatten()
+        units[name] = df_calibration[name].columns[0]
+    return CalibrationSurface(unique_pitch, unique_yaw, channels, {'linear': 1, 'cubic': 3}[method], units)
+
+
+def solve_pitch_and_yaw_in_cell(surface, c_p_experiment, pitch, yaw, half_width, iterations=10):
+    pitch_low = np.maximum(pitch - half_width, surface.pitch_limits[0])    # keep each solution inside its cell
+    pitch_high = np.minimum(pitch + half_width, surface.pitch_limits[1])
+    yaw_low = np.maximum(yaw - half_width, surface.yaw_limits[0])
+    yaw_high = np.minimum(yaw + half_width, surface.yaw_limits[1])
+    pitch, yaw = np.array(pitch, dtype=float), np.array(yaw, dtype=float)
+    cost = np.sum((surface.evaluate_c_p_locals(pitch, yaw) - c_p_experiment) ** 2, axis=1)
+    damping = np.zeros(len(pitch)) + 1e-3
+    for iteration in range(iterations):                     # damped Gauss-Newton steps for all samples at once
+        residual = surface.evaluate_c_p_locals(pitch, yaw) - c_p_experiment
+        jacobian_pitch = surface.evaluate_c_p_locals(pitch, yaw, d_pitch=1)
+        jacobian_yaw = surface.evaluate_c_p_locals(pitch, yaw, d_yaw=1)
+        a = np.sum(jacobian_pitch ** 2, axis=1) * (1 + damping)
+        b = np.sum(jacobian_pitch * jacobian_yaw, axis=1)
+        d = np.sum(jacobian_yaw ** 2, axis=1) * (1 + damping)
+        gradient_pitch = np.sum(jacobian_pitch * residual, axis=1)
+        gradient_yaw = np.sum(jacobian_yaw * residual, axis=1)
+        determinant = a * d - b ** 2
+        determinant[determinant == 0] = np.inf                  # no step where the surfaces are flat
+        pitch_trial = np.clip(pitch - (d * gradient_pitch - b * gradient_yaw) / determinant, pitch_low, pitch_high)
+        yaw_trial = np.clip(yaw - (a * gradient_yaw - b * gradient_pitch) / determinant, yaw_low, yaw_high)
+        cost_trial = np.sum((surface.evaluate_c_p_locals(pitch_trial, yaw_trial) - c_p_experiment) ** 2, axis=1)
+        improved = cost_trial < cost
+        pitch[improved], yaw[improved] = pitch_trial[improved], yaw_trial[improved]
+        cost[improved] = cost_trial[improved]
+        damping[improved] *= 0.3
+        damping[~improved] *= 10
+    return pitch, yaw, cost
+
+
+@monitored()
+def refine_pitch_and_yaw_on_surface(df_experiment, df_interpolation, iterations=10):
+    print("solving pitch (alpha) and yaw (beta) of measured parameters within calibration cells")
+    surface = df_interpolation
+    if not isinstance(surface, CalibrationSurface):
+        calibration = df_interpolation
+        if not isinstance(calibration, CalibrationTable):
+            calibration = create_calibration_table(df_interpolation)
+        surface = create_calibration_surface(calibration)
+    prev_resolution = df_experiment['resolution'].iat[0, 0]
+    c_p_experiment = np.array(df_experiment[surface.c_p_labels]).astype(float)
+    pitch = np.array(df_experiment['pitch']).flatten()
+    yaw = np.array(df_experiment['yaw']).flatten()
+    pitch, yaw, closest_match = solve_pitch_and_yaw_in_cell(surface, c_p_experiment, pitch, yaw, prev_resolution,
+                                                            iterations)
+    print(f"solved {df_experiment.shape[0]} points")
+
+    df_experiment['pitch', '(deg)'] = pitch
+    df_experiment['yaw', '(deg)'] = yaw
+    df_experiment['c_p_static', '(ratio)'] = surface.evaluate('c_p_static', pitch, yaw)
+    df_experiment['c_p_total', '(ratio)'] = surface.evaluate('c_p_total', pitch, yaw)
+    df_experiment['closest_match', '(ratio)'] = closest_match
+
+
+def solve_pitch_and_yaw(c_p_experiment, calibration_coarse, calibration_fine, chunk_size=None, iterations=10):
+    pitch, yaw, c_p_static, c_p_total, closest_match = find_closest_calibration_points(calibration_coarse,
+                                                                                       c_p_experiment)
+    if isinstance(calibration_fine, CalibrationSurface):
+        pitch, yaw, closest_match = solve_pitch_and_yaw_in_cell(calibration_fine, c_p_experiment, pitch, yaw,
+                                                                calibration_coarse.resolution, iterations)
+        return (pitch, yaw, calibration_fine.evaluate('c_p_static', pitch, yaw),
+                calibration_fine.evaluate('c_p_total', pitch, yaw), closest_match)
+    return find_closest_calibration_points_in_window(calibration_fine, c_p_experiment, pitch, yaw,
+                                                     calibration_coarse.resolution, chunk_size)
+
+
+worker_calibrations = dict()    # calibrations of an angle worker process, set once when the worker starts
+
+
+def set_worker_calibrations(calibration_coarse, calibration_fine):
+    worker_calibrations['coarse'], worker_calibrations['fine'] = calibration_coarse, calibration_fine
+
+
+def solve_pitch_and_yaw_shard(c_p_experiment, chunk_size=None, iterations=10):  # executed in a worker process
+    return solve_pitch_and_yaw(c_p_experiment, worker_calibrations['coarse'], worker_calibrations['fine'],
+                               chunk_size, iterations)
+
+
+def create_angle_pool(calibration_coarse, calibration_fine, workers=None):  # one pool for all chunks of a run
+    workers = workers or os.cpu_count() or 1
+    context = fork_context()                        # run scripts are not guarded against being re-run by workers
+    if workers <= 1 or context is None:
+        return None                                 # the lookup runs in turn
+    if not isinstance(calibration_coarse, CalibrationTable):
+        calibration_coarse = create_calibration_table(calibration_coarse)
+    if not isinstance(calibration_fine, (CalibrationTable, CalibrationSurface)):
+        calibration_fine = create_calibration_table(calibration_fine)
+    print(f"starting {workers} processes for the pitch (alpha) and yaw (beta) lookup")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=set_worker_calibrations,
+                               initargs=(calibration_coarse, calibration_fine))
+
+
+@monitored()
+def calculate_pitch_and_yaw_parallel(df_experiment, calibration_coarse, calibration_fine, angle_pool, chunk_size=None,
+                                     iterations=10, shards=64):  # coarse lookup and refinement in a create_angle_pool
+    if not isinstance(calibration_coarse, CalibrationTable):
+        calibration_coarse = create_calibration_table(calibration_coarse)
+    if not isinstance(calibration_fine, (CalibrationTable, CalibrationSurface)):
+        calibration_fine = create_calibration_table(calibration_fine)
+    if list(calibration_fine.c_p_labels) != list(calibration_coarse.c_p_labels):
+        raise ValueError("the coarse and fine calibrations do not share the same pressure coefficients")
+    c_p_experiment = np.array(df_experiment[calibration_coarse.c_p_labels]).astype(float)
+    n_samples = c_p_experiment.shape[0]
+    shards = np.array_split(c_p_experiment, max(1, min(shards, n_samples)))    # more shards than workers balance them
+    print(f"determining pitch (alpha) and yaw (beta) of {n_samples} points in {len(shards)} shards")
+
+    progress = ProgressReporter("pitch and yaw", n_samples)
+    results = list()
+    for result in angle_pool.map(solve_pitch_and_yaw_shard, shards, [chunk_size] * len(shards),
+                                 [iterations] * len(shards)):       # results arrive in the order of the shards
+        results.append(result)
+        progress.update(len(result[0]))
+    progress.close()
+    pitch, yaw, c_p_static, c_p_total, closest_match = [np.concatenate(parts) for parts in zip(*results)]
+    print(f"found {n_samples} points")
+
+    resolution = calibration_coarse.resolution                      # the surface keeps the coarse resolution
+    if isinstance(calibration_fine, CalibrationTable):
+        resolution = calibration_fine.resolution
+    df_experiment['resolution', '(deg)'] = np.zeros((n_samples, 1), dtype=float) + resolution
+    df_experiment['pitch', '(deg)'] = pitch
+    df_experiment['yaw', '(deg)'] = yaw
+    df_experiment['c_p_static', '(ratio)'] = c_p_static
+    df_experiment['c_p_total', '(ratio)'] = c_p_total
+    df_experiment['closest_match', '(ratio)'] = closest_match
+
+
+@monitored()
 def calculate_velocity_components(df_experiment, switch_y_and_z=False):
     print("calculating flow velocity components")
     pitch_rad = np.deg2rad(np.array(df_experiment['pitch']))
@@ -243,6 +413,23 @@ def calculate_velocity_components(df_experiment, switch_y_and_z=False):
         df_experiment['velocity_z', '(m/s)'] = velocity_y
 
 
+@monitored()
+def process_multi_hole_pressures(df_experiment, calibration_coarse, calibration_fine, switch_y_and_z=False,
+                                 chunk_size=None, iterations=10, angle_pool=None):
+    calculate_dimensionless_pressure(df_experiment)
+    if angle_pool is not None:                                      # see create_angle_pool
+        calculate_pitch_and_yaw_parallel(df_experiment, calibration_coarse, calibration_fine, angle_pool, chunk_size,
+                                         iterations)
+    elif isinstance(calibration_fine, CalibrationSurface):
+        calculate_pitch_and_yaw(df_experiment, calibration_coarse)
+        refine_pitch_and_yaw_on_surface(df_experiment, calibration_fine, iterations)  # solve within coarse cells
+    else:
+        calculate_pitch_and_yaw(df_experiment, calibration_coarse)
+        enhance_pitch_and_yaw(df_experiment, calibration_fine, chunk_size)  # rerun on finer grid
+    calculate_velocity_components(df_experiment, switch_y_and_z)
+
+
+@monitored()
 def calculate_pitot_rake_velocities(df_experiment, channels):
     print("calculating flow velocity from Pitot Rake pressures")
     densities = np.array(df_experiment['density'])
@@ -276,70 +463,89 @@ def create_variable_to_unit_dictionary(data_frame):
     return var_to_unit
 
 
-def check_probe_and_printer_overlap(df_measurements, df_printer):
-    printer_start, printer_end = df_printer['epoch_start'].iat[0, 0], df_printer['epoch_end'].iat[0, 0]
-    probe_start, probe_end = df_measurements['epoch'].iat[0, 0], df_measurements['epoch'].iat[-1, 0]
-    if printer_start < probe_start and printer_end > probe_end:
-        print("WARNING: sampling was turned on too late and turned off too early")
-        exit()
-    elif printer_start < probe_start:
-        overlap = round((probe_start - printer_start), 2)
-        print(f"WARNING: sampling was turned on too late by {overlap} seconds")
-        if overlap > 4:
-            print("terminating early")
-            exit()
-    elif printer_end > probe_end:
-        overlap = round((printer_end - probe_end), 2)
-        print(f"WARNING: sampling was turned off too early by {overlap} seconds")
-        exit()
-    else:
-        print("sampling times and position times overlap correctly")
+def align_samples_to_windows(probe_epochs, printer_starts, printer_ends):  # requires sorted probe epochs
+    probe_epochs = np.asarray(probe_epochs, dtype=float).flatten()
+    printer_starts = np.asarray(printer_starts, dtype=float).flatten()
+    printer_ends = np.asarray(printer_ends, dtype=float).flatten()
+    index_starts = np.searchsorted(probe_epochs, printer_starts, side='left')       # first sample in each window
+    index_ends = np.searchsorted(probe_epochs, printer_ends, side='right') - 1      # last sample in each window
+    sample_counts = np.maximum(index_ends - index_starts + 1, 0)
+
+    intervals = np.diff(probe_epochs)
+    max_interval = 1.5 * np.median(intervals) if len(intervals) > 0 else np.inf    # larger intervals are gaps
+    gap_count = np.concatenate(([0], np.cumsum(intervals > max_interval)))
+    first = np.minimum(index_starts, len(probe_epochs) - 1)
+    last = np.clip(index_ends, 0, len(probe_epochs) - 1)
+    gap_inside = gap_count[last] > gap_count[first]
+    gap_at_start = probe_epochs[first] - printer_starts > max_interval
+    gap_at_end = printer_ends - probe_epochs[last] > max_interval
+    covered = (sample_counts > 0) & ~gap_inside & ~gap_at_start & ~gap_at_end
+    return index_starts, index_ends, sample_counts, covered
 
 
-def find_start_and_end_indices(df_measurements, df_printer):
+def check_probe_and_printer_overlap(df_measurements, df_printer):
     printer_starts, printer_ends = np.array(df_printer['epoch_start']), np.array(df_printer['epoch_end'])
     probe_epochs = np.array(df_measurements['epoch'])
-    points = df_printer.shape[0]
-    index_starts, index_ends = np.zeros(points).astype(int), np.zeros(points).astype(int)
-    start, counter = True, 0
-    for index, probe_epoch in enumerate(probe_epochs):
-        if printer_starts[counter] <= probe_epoch <= printer_ends[counter]:
-            if start is True:
-                index_starts[counter] = index
-                start = False
-        else:
-            if start is False:
-                index_ends[counter] = index - 1
-                counter += 1
-                start = True
-        if counter == points:
-            break
-    return index_starts, index_ends
-
-
-def calculate_avg_std_cov(df_processed, df_measurements, process, unit, index_starts, index_ends):
-    data = np.array(df_measurements[process])
-    averages = np.array(list())
-    standard_deviations = np.array(list())
-    coefficients_of_variation = np.array(list())
-    for index_start, index_end in zip(index_starts, index_ends):
-        average = np.average(data[index_start:index_end])
-        averages = np.append(averages, average)
-        standard_deviation = np.std(data[index_start:index_end])
-        standard_deviations = np.append(standard_deviations, standard_deviation)
-        if average != 0:
-            coefficients_of_variation = np.append(coefficients_of_variation, standard_deviation / average)
-        else:
-            coefficients_of_variation = np.append(coefficients_of_variation, 0)
-    df_processed[f'{process}_avg', unit] = averages
-    df_processed[f'{process}_std', unit] = standard_deviations
-    df_processed[f'{process}_cov', unit] = coefficients_of_variation
-
-
+    index_starts, index_ends, sample_counts, covered = align_samples_to_windows(probe_epochs, printer_starts,
+                                                                                printer_ends)
+    printer_start, printer_end = np.amin(printer_starts), np.amax(printer_ends)
+    probe_start, probe_end = probe_epochs[0, 0], probe_epochs[-1, 0]
+    if printer_start < probe_start:
+        print(f"WARNING: sampling was turned on too late by {round((probe_start - printer_start), 2)} seconds")
+    if printer_end > probe_end:
+        print(f"WARNING: sampling was turned off too early by {round((printer_end - probe_end), 2)} seconds")
+    if not np.any(covered):
+        raise ValueError(f"none of the {len(covered)} positions is covered by samples, check that the printer log "
+                         f"belongs to this measurement")
+    if np.all(covered):
+        print("sampling times and position times overlap correctly")
+    else:
+        missing = np.where(~covered)[0]
+        print(f"WARNING: {len(missing)} of {len(covered)} positions are not fully covered by samples (list below):")
+        print(f'-> {missing}')
+        print(f'-> samples per position: {sample_counts[missing]}')
+    return index_starts, index_ends, sample_counts, covered
+
+
+def calculate_segment_statistics(data, index_starts, index_ends):  # statistics of all columns and segments at once
+    data = np.asarray(data, dtype=float)
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+    starts, ends = np.asarray(index_starts, dtype=int), np.asarray(index_ends, dtype=int)
+    counts = np.maximum(ends - starts, 0)                           # segments are sliced as data[start:end]
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(int)
+    gather = np.arange(np.sum(counts)) - np.repeat(offsets - starts, counts)
+    samples = data[gather]                                          # all segments laid out back to back
+    filled = counts > 0
+    averages = np.full((len(counts), data.shape[1]), np.nan)
+    standard_deviations = np.full((len(counts), data.shape[1]), np.nan)
+    if np.any(filled):
+        sums = np.add.reduceat(samples, offsets[filled], axis=0)
+        averages[filled] = sums / counts[filled, np.newaxis]
+        deviations = samples - np.repeat(averages[filled], counts[filled], axis=0)
+        squares = np.add.reduceat(deviations ** 2, offsets[filled], axis=0)
+        standard_deviations[filled] = np.sqrt(squares / counts[filled, np.newaxis])
+    coefficients_of_variation = np.zeros_like(averages)
+    non_zero = averages != 0
+    coefficients_of_variation[non_zero] = standard_deviations[non_zero] / averages[non_zero]
+    return averages, standard_deviations, coefficients_of_variation
+
+
+def calculate_avg_std_cov_columns(df_processed, df_measurements, processes, units, index_starts, index_ends):
+    data = np.column_stack([np.array(df_measurements[process]).flatten() for process in processes])
+    averages, standard_deviations, coefficients_of_variation = \
+        calculate_segment_statistics(data, index_starts, index_ends)
+    for column, (process, unit) in enumerate(zip(processes, units)):
+        df_processed[f'{process}_avg', unit] = averages[:, column]
+        df_processed[f'{process}_std', unit] = standard_deviations[:, column]
+        df_processed[f'{process}_cov', unit] = coefficients_of_variation[:, column]
+    return averages, standard_deviations, coefficients_of_variation
+
+
+@monitored()
 def filter_multi_hole_probe_field(df_measurements, df_printer):
-    check_probe_and_printer_overlap(df_measurements, df_printer)
     print("filtering measured multi-hole probe data based on coordinates")
-    index_starts, index_ends = find_start_and_end_indices(df_measurements, df_printer)
+    index_starts, index_ends, _, _ = check_probe_and_printer_overlap(df_measurements, df_printer)
 
     df_processed = pd.DataFrame()
     df_processed['probe_x'] = df_printer['probe_x']
@@ -349,25 +555,19 @@ def filter_multi_hole_probe_field(df_measurements, df_printer):
     variables = ['yaw', 'pitch', 'density', 'temperature', 'velocity_mag',
                  'velocity_x', 'velocity_y', 'velocity_z', 'closest_match']
     variable_units = ['(deg)', '(deg)', '(kg/m^3)', '(deg C)', '(m/s)', '(m/s)', '(m/s)', '(m/s)', '(ratio)']
-    for variable, unit in zip(variables, variable_units):
-        calculate_avg_std_cov(df_processed, df_measurements, variable, unit, index_starts, index_ends)
-
-    velocity_mag = np.array(df_measurements['velocity_mag'])
-    turbulence_intensity = np.array(list())
-    for index_start, index_end in zip(index_starts, index_ends):
-        point_velocities = velocity_mag[index_start:index_end]
-        average_velocity = np.average(point_velocities)
-        samples = len(point_velocities)
-        deviation = np.sum((point_velocities - average_velocity) ** 2)
-        turbulence_intensity = np.append(turbulence_intensity, ((1 / samples) * deviation) ** 0.5 / average_velocity)
+    averages, standard_deviations, _ = calculate_avg_std_cov_columns(df_processed, df_measurements, variables,
+                                                                     variable_units, index_starts, index_ends)
+    velocity_column = variables.index('velocity_mag')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        turbulence_intensity = standard_deviations[:, velocity_column] / averages[:, velocity_column]
     df_processed[f'turb_int', '(ratio)'] = turbulence_intensity
     return df_processed
 
 
+@monitored()
 def filter_pitot_rake_field(df_measurements, df_printer, pitot_rake_offsets, offset_in_x):
-    check_probe_and_printer_overlap(df_measurements, df_printer)
     print("filtering measured pitot rake data based on coordinates")
-    index_starts, index_ends = find_start_and_end_indices(df_measurements, df_printer)
+    index_starts, index_ends, _, _ = check_probe_and_printer_overlap(df_measurements, df_printer)
 
     probe_x_in = np.array(df_printer['probe_x']).flatten()
     probe_y_in = np.array(df_printer['probe_y']).flatten()
@@ -376,9 +576,12 @@ def filter_pitot_rake_field(df_measurements, df_printer, pitot_rake_offsets, off
     df_split.columns = pd.MultiIndex.from_product([df_split.columns, ['(mm)']])
     df_split['probe_y', 'mm'] = probe_y_in
     variables, variable_units = ['P', 'V'], ['(Pa)', '(m/s)']
+    processes, units = list(), list()
     for var, unit in zip(variables, variable_units):
         for idx, offset in enumerate(pitot_rake_offsets):
-            calculate_avg_std_cov(df_split, df_measurements, f'{var}{idx}', unit, index_starts, index_ends)
+            processes.append(f'{var}{idx}')
+            units.append(unit)
+    calculate_avg_std_cov_columns(df_split, df_measurements, processes, units, index_starts, index_ends)
 
     probe_x = np.array(list())
     probe_y = np.array(list())
@@ -410,37 +613,71 @@ def filter_pitot_rake_field(df_measurements, df_printer, pitot_rake_offsets, off
     return df_processed
 
 
-def filter_data_into_time_frames(df_measurements, time_frames, names, reduction, units, variables):
+def find_time_frame_indices(probe_times, starts, ends, tolerance, sample_duration):  # frame bounds (sorted times)
+    index_starts = np.searchsorted(probe_times, starts - tolerance, side='left')   # nearest sample to each boundary
+    index_ends = np.searchsorted(probe_times, ends - tolerance, side='left')
+    leading = np.round((probe_times[0] - starts) / sample_duration)                # samples missing before the log
+    leading = np.where(index_starts == 0, np.maximum(leading, 0), 0).astype(int)
+    return index_starts, np.maximum(index_ends, index_starts), leading
+
+
+def extract_time_frames(values, index_starts, index_ends, leading, n_samples):  # frame x sample x variable, nan padded
+    slots = np.arange(n_samples) - leading[:, None]                 # leading slots lie before the first sample
+    sample_indices = index_starts[:, None] + slots
+    inside = (slots >= 0) & (sample_indices < index_ends[:, None])
+    frames = values[np.clip(sample_indices, 0, len(values) - 1)]
+    frames[~inside] = np.nan
+    return frames
+
+
+def moving_average_frames(frames, span):  # trailing mean over span samples, as pandas rolling(span).mean()
+    span = int(span)
+    valid = ~np.isnan(frames)
+    centre = (np.where(valid, frames, 0).sum(axis=1, keepdims=True) /
+              np.maximum(valid.sum(axis=1, keepdims=True), 1))      # centred sums keep the cumulative sum accurate
+    shape = (frames.shape[0], 1, frames.shape[2])
+    sums = np.concatenate((np.zeros(shape), np.cumsum(np.where(valid, frames - centre, 0), axis=1)), axis=1)
+    counts = np.concatenate((np.zeros(shape, dtype=int), np.cumsum(valid, axis=1)), axis=1)
+    smooth = np.full(frames.shape, np.nan)
+    if span <= frames.shape[1]:
+        window_sums = sums[:, span:] - sums[:, :-span]
+        window_counts = counts[:, span:] - counts[:, :-span]
+        smooth[:, span - 1:] = np.where(window_counts == span, window_sums / span + centre, np.nan)
+    return smooth
+
+
+@monitored()
+def filter_data_into_time_frames(df_measurements, time_frames, names, reduction, units, variables, tolerance=None):
     var_to_unit = create_variable_to_unit_dictionary(df_measurements)
     if reduction is None or reduction < 1:
         print('reduction is forced to be 1')
         reduction = 1
     if len(time_frames) != len(names):
         print('ERROR: Number of timeframes must match timeframe names')
-    starts = np.array(time_frames)[:, 0]
-    ends = starts + np.array(time_frames)[:, 1]
-    probe_times = np.array(df_measurements['time'])
+    starts = np.array(time_frames, dtype=float)[:, 0]
+    ends = starts + np.array(time_frames, dtype=float)[:, 1]
+    probe_times = np.array(df_measurements['time'], dtype=float).flatten()
     sample_duration = float((probe_times[1] - probe_times[0]))
-    max_sample_number = int(np.amax(ends - starts) / sample_duration)
+    if tolerance is None:
+        tolerance = sample_duration / 2                             # frames start at the nearest sample
+    max_sample_number = int(round(np.amax(ends - starts) / sample_duration))
     frame_duration = float(sample_duration * max_sample_number)
-    df_std = pd.DataFrame()
-    df_std['time'] = np.linspace(sample_duration, frame_duration, max_sample_number)
-    df_std.columns = pd.MultiIndex.from_product([df_std.columns, ['(s)']])    # initialise multi-index
-    df_smooth = df_std.copy()
-
-    for name, start, end in zip(names, starts, ends):
-        min_index = np.where(probe_times == start)[0][0]
-        max_index = np.where(probe_times == end)[0][0]
-        for variable in variables:
-            array = np.array(df_measurements[variable])[min_index:max_index]
-            temp_length = len(array)
-            if temp_length < max_sample_number:
-                nan_array = np.empty(max_sample_number - temp_length)
-                nan_array[:] = np.nan
-                array = np.append(array, nan_array)
-            new_name = f'{variable}@{name}_{units[1]}'
-            df_std[new_name, var_to_unit[variable]] = array
-            df_smooth[new_name, var_to_unit[variable]] = df_std[new_name].rolling(int(reduction)).mean()
+
+    index_starts, index_ends, leading = find_time_frame_indices(probe_times, starts, ends, tolerance, sample_duration)
+    index_ends = np.minimum(index_ends, index_starts + np.maximum(max_sample_number - leading, 0))
+    for name, start, end, index_start, index_end in zip(names, starts, ends, index_starts, index_ends):
+        if index_end - index_start < int(round((end - start) / sample_duration)):
+            print(f"WARNING: time frame {name} ({start} to {end} s) is only covered by {index_end - index_start} "
+                  f"samples")
+    values = np.column_stack([np.array(df_measurements[variable], dtype=float).flatten() for variable in variables])
+    frames = extract_time_frames(values, index_starts, index_ends, leading, max_sample_number)
+    smooth = moving_average_frames(frames, reduction)
+
+    columns = pd.MultiIndex.from_tuples([(f'{variable}@{name}_{units[1]}', var_to_unit[variable])
+                                         for name in names for variable in variables])  # frame-major column order
+    df_time = pd.DataFrame({('time', '(s)'): np.linspace(sample_duration, frame_duration, max_sample_number)})
+    df_std, df_smooth = [pd.concat([df_time, pd.DataFrame(array.transpose(1, 0, 2).reshape(max_sample_number, -1),
+                                                          columns=columns)], axis=1) for array in (frames, smooth)]
     return df_std, df_smooth
 
 
@@ -521,8 +758,12 @@ def calculate_average_field_values(data_frame):
     df_fields = pd.DataFrame()
     first = True
     for heading, unit in zip(headings, units):
-        average = np.average(np.array(data_frame[heading]))
-        standard_deviation = np.std(np.array(data_frame[heading]))
+        values = np.array(data_frame[heading], dtype=float)
+        if not np.any(np.isfinite(values)):
+            print(f"WARNING: no position holds a value of {heading}")
+            average, standard_deviation = np.nan, np.nan
+        else:                                                       # positions without samples are left out
+            average, standard_deviation = np.nanmean(values), np.nanstd(values)
         heading = heading.replace('_avg', '')
         if first is True:
             first = False
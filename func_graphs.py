@@ -1,9 +1,13 @@
 """This Python module contains a set of functions related to graphing data measured by a range of pressure
 sensing devices"""
 
+import os
+import copy
 import math
 import numpy as np
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from func_monitor import monitored, ProgressReporter, fork_context
 from matplotlib.cm import ScalarMappable
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
@@ -102,15 +106,15 @@ def normalise_data(df_graph):
 
 def check_limits(df_graph):
     lim_low, lim_high, data = df_graph.limits[0], df_graph.limits[1], np.array(df_graph.data)
-    min_data, max_data = np.amin(data), np.amax(data)
+    min_data, max_data = np.nanmin(data), np.nanmax(data)              # ignore positions without samples
     if lim_low is None and lim_high is None:
         ticks = tick_generator(min_data, max_data)            # generate ticks for colour bar
     elif lim_low is None:
         print(f"upper limit is forced below {lim_high}")                # print message to console
-        ticks = tick_generator(np.amin(data), lim_high)                 # generate ticks for colour bar
+        ticks = tick_generator(min_data, lim_high)                      # generate ticks for colour bar
     elif lim_high is None:
         print(f"lower limit is forced above {lim_low}")                 # print message to console
-        ticks = tick_generator(lim_low, np.amax(data))                  # generate ticks for colour bar
+        ticks = tick_generator(lim_low, max_data)                       # generate ticks for colour bar
     else:
         print(f"limits are forced between {lim_low} and {lim_high}")    # print message to console
         ticks = tick_generator(lim_low, lim_high)                       # generate ticks for colour bar
@@ -118,7 +122,14 @@ def check_limits(df_graph):
     return t_min, t_max, ticks
 
 
-def create_heat_map(df_graph, safe_location):
+def save_figure(safe_location, dpi=300, file_format=None):
+    if file_format is not None:                     # matplotlib uses the file name as given, so add the extension
+        safe_location = f'{safe_location}.{file_format}'
+    plt.savefig(safe_location, dpi=dpi, format=file_format, bbox_inches='tight')
+    return safe_location
+
+
+def create_heat_map(df_graph, safe_location, dpi=300, file_format=None):
     t_min, t_max, ticks = check_limits(df_graph)                                            # check and set graph limits
     pivot_table = df_graph.data_pivot
     figure, axis = plt.subplots()                                                           # generate figure and axes
@@ -134,12 +145,12 @@ def create_heat_map(df_graph, safe_location):
     bar_label = df_graph.bar_label
     plt.colorbar(heat_map, cax=cax, label=bar_label, ticks=ticks, orientation="vertical")   # create the color bar
     plt.tight_layout(pad=0.5)                                                               # set a tight layout
-    plt.savefig(safe_location, dpi=300, bbox_inches='tight')                                # safe the figure
+    safe_location = save_figure(safe_location, dpi, file_format)                            # safe the figure
     plt.close(figure)                                                                       # close the figure
     print(f"saving heat map to {safe_location}")                                            # print progress to console
 
 
-def create_contour_plot(df_graph, safe_location):
+def create_contour_plot(df_graph, safe_location, dpi=300, file_format=None):
     t_min, t_max, ticks = check_limits(df_graph)    # check and set graph limits
     figure, axis = plt.subplots()                   # generate figure and axes
     axis.set_title(df_graph.heading)                # set graph heading
@@ -156,31 +167,31 @@ def create_contour_plot(df_graph, safe_location):
     bar_label = df_graph.bar_label
     plt.colorbar(contour_map, ticks=ticks, cax=cax, label=bar_label, boundaries=boundaries, values=values)  # colour bar
     plt.tight_layout(pad=0.5)                                                               # set a tight layout
-    plt.savefig(safe_location, dpi=300, bbox_inches='tight')                                # safe the figure
+    safe_location = save_figure(safe_location, dpi, file_format)                            # safe the figure
     plt.close(figure)                                                                       # close the figure
     print(f"saving contour plot to {safe_location}")                                        # print progress to console
 
 
-def create_scatter_plot(df_graph, safe_location):
+def create_scatter_plot(df_graph, safe_location, dpi=300, file_format=None):
     t_min, t_max, ticks = check_limits(df_graph)                                        # check and set graph limits
     figure, axis = plt.subplots()                                                       # generate figure and axes
     axis.set_title(df_graph.heading)                                                    # set graph heading
     axis.set_xlabel(df_graph.x_axis_label)                                              # set x label
     axis.set_ylabel(df_graph.y_axis_label)                                              # set y label
     axis.set_aspect('equal')                                                            # equal axis aspect ratio
-    colour_map = plt.cm.get_cmap('jet')                                                 # set plot colour scheme
+    colour_map = plt.get_cmap('jet')                                                    # set plot colour scheme
     x, y, z = df_graph.x_coordinates, df_graph.y_coordinates, df_graph.data             # retrieve the colour map
     scatter = plt.scatter(x, y, c=z, s=40, cmap=colour_map, vmin=t_min, vmax=t_max)     # define the scatter data
     divider = make_axes_locatable(axis)                                                 # make axes callable by code
     cax = divider.append_axes('right', size='5%', pad=0.1)                              # set spacing to the axes
     plt.colorbar(scatter, cax=cax, ticks=ticks, label=df_graph.bar_label)               # create the color bar
     plt.tight_layout(pad=0.5)                                                           # set a tight layout
-    plt.savefig(safe_location, dpi=300, bbox_inches='tight')                            # safe the figure
+    safe_location = save_figure(safe_location, dpi, file_format)                        # safe the figure
     plt.close(figure)                                                                   # close the figure
     print(f"saving scatter plot to {safe_location}")                                    # print progress to console
 
 
-def create_glyph_plot(df_graph, safe_location):
+def create_glyph_plot(df_graph, safe_location, dpi=300, file_format=None):
     x_coords, y_coords = df_graph.x_coordinates, df_graph.y_coordinates
     data_y, data_z = df_graph.data_y, df_graph.data_z
     t_min, t_max, ticks = check_limits(df_graph)            # check and set graph limits
@@ -206,9 +217,59 @@ def create_glyph_plot(df_graph, safe_location):
         vectors = plt.quiver(x_coords, y_coords, data_y, data_z)            # plot a field of arrows
 
     plt.tight_layout(pad=0.5)                                               # set a tight layout
-    plt.savefig(safe_location, dpi=300, bbox_inches='tight')                # safe the figure
+    safe_location = save_figure(safe_location, dpi, file_format)            # safe the figure
     plt.close(figure)                                                       # close the figure
     print(f"saving glyph plot to {safe_location}")                          # print progress to console
 
+
+def figure_job(df_graph, plot_kind, safe_location):  # snapshot the graph bundle as the scripts keep modifying it
+    return copy.deepcopy(df_graph), plot_kind, safe_location
+
+
+def figure_has_values(job):  # figures without any finite value have no limits or ticks and are not drawn
+    return bool(np.any(np.isfinite(np.array(job[0].data, dtype=float))))
+
+
+def figure_files(jobs, file_format=None):  # the files render_figures will write for a list of jobs
+    extension = file_format if file_format is not None else plt.rcParams['savefig.format']
+    return [f'{safe_location}.{extension}' for _, _, safe_location in filter(figure_has_values, jobs)]
+
+
+def render_figure(job, dpi=300, file_format=None):
+    df_graph, plot_kind, safe_location = job
+    if not figure_has_values(job):
+        print(f"skipping {safe_location} as no position holds a value")
+        return None
+    plot_functions = {'heat': create_heat_map, 'scatter': create_scatter_plot, 'contour': create_contour_plot,
+                      'glyph': create_glyph_plot}
+    plot_functions[plot_kind](df_graph, safe_location, dpi, file_format)
+
+
+def use_agg_backend():  # workers only write files, so they do not need an interactive backend
+    plt.switch_backend('Agg')
+
+
+@monitored()
+def render_figures(jobs, workers=None, dpi=300, file_format=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    context = fork_context()
+    if context is None:                             # run scripts are not guarded against being re-run by workers
+        workers = 1
+    workers = min(workers, len(jobs))
+    print(f"rendering {len(jobs)} figures using {max(workers, 1)} processes")
+    progress = ProgressReporter("rendering figures", len(jobs), 'figures')
+    if workers <= 1:
+        for job in jobs:
+            render_figure(job, dpi, file_format)
+            progress.update()
+        progress.close()
+        return None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=use_agg_backend) as executor:
+        for _ in executor.map(render_figure, jobs, [dpi] * len(jobs), [file_format] * len(jobs)):
+            progress.update()                       # re-raises the first error of any worker
+    progress.close()
+    return None
+
 # end of code
 
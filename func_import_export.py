@@ -2,68 +2,435 @@
 by a variety of pressure measuring devices"""
 
 import os
+import re
+import sys
+import gzip
+import json
+import time
+import pickle
+import hashlib
 import pandas as pd
 from func_data import *
+from func_classes import load_calibration_table
+from func_monitor import *
+try:                            # optional multi-threaded parser and columnar files for large data sets
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.ipc
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 
 # -------------------- functions for importing data  -------------------- #
 
+@monitored(rows='result')
 def import_csv_pandas(file_location):  # import pressure raw calibration data using pandas
+    if not os.path.exists(file_location) and os.path.exists(f'{file_location}.gz'):
+        file_location = f'{file_location}.gz'                       # compressed export of the same data
     print(f"importing {file_location}")
     content = pd.read_csv(file_location, header=[0, 1])
     return content
 
 
+@monitored(rows='result')
+def import_data_columnar(file_location, variables=None):  # import selected variables of a feather or parquet file
+    print(f"importing {file_location}")
+    if file_location.endswith('.parquet'):
+        table = pyarrow.parquet.read_table(file_location, columns=variables, memory_map=True)
+    else:
+        table = pyarrow.feather.read_table(file_location, columns=variables, memory_map=True)
+    units = json.loads(table.schema.metadata[b'units'])
+    content = table.to_pandas()
+    content.columns = pd.MultiIndex.from_tuples([(variable, units[variable]) for variable in content.columns])
+    return content
+
+
+def intermediate_location(file_location, file_format):  # swap the file extension for the intermediate format
+    if file_format == 'csv':
+        return file_location
+    return f'{os.path.splitext(file_location)[0]}.{file_format}'
+
+
+def intermediate_file(file_location, file_format='csv', compress=False):  # file written by export_intermediate
+    if file_format == 'csv' or pyarrow is None:
+        return f'{file_location}.gz' if compress is True else file_location
+    return intermediate_location(file_location, file_format)
+
+
+def import_intermediate(file_location, variables=None, file_format='csv'):  # import data handed between stages
+    columnar_location = intermediate_location(file_location, file_format)
+    if file_format != 'csv' and pyarrow is not None and os.path.exists(columnar_location):
+        return import_data_columnar(columnar_location, variables)
+    content = import_csv_pandas(file_location)
+    if variables is not None:
+        content = content[variables]
+    return content
+
+
+file_hashes = dict()            # hashes computed by this process, so stages sharing an input read it only once
+
+
+def hash_file(file_location, block_size=2 ** 20):  # content hash used to detect changed input files
+    status = os.stat(file_location)
+    key = (os.path.abspath(file_location), status.st_size, status.st_mtime_ns)
+    if key not in file_hashes:
+        file_hash = hashlib.sha256()
+        with open(file_location, 'rb') as file:
+            for block in iter(lambda: file.read(block_size), b''):
+                file_hash.update(block)
+        file_hashes[key] = file_hash.hexdigest()
+    return file_hashes[key]
+
+
+@monitored(rows=None)
+def import_calibration_table(interpolation_location, calibration_location, interp_size, cache_directory):
+    calibration_hash = hash_file(calibration_location)
+    interpolation_stat = os.stat(interpolation_location)
+    size_name = (str("%.2f" % float(interp_size)).replace(".", "-"))
+    cache_location = os.path.join(cache_directory, f'calibration_{calibration_hash[:16]}_{size_name}')
+    meta_location = os.path.join(cache_location, 'table.json')
+    meta_expected = {'calibration_hash': calibration_hash, 'interp_size': float(interp_size),
+                     'interpolation_size': interpolation_stat.st_size,
+                     'interpolation_mtime': interpolation_stat.st_mtime_ns, 'search_index': 'sectors'}
+
+    if os.path.exists(meta_location):
+        with open(meta_location, 'r') as file:
+            meta = json.load(file)
+        if all(meta.get(key) == value for key, value in meta_expected.items()):
+            print(f"loading cached calibration table from {cache_location}")
+            return load_calibration_table(cache_location)
+        print(f"cached calibration table in {cache_location} is out of date")
+
+    calibration = create_calibration_table(import_csv_pandas(interpolation_location))
+    os.makedirs(cache_location, exist_ok=True)
+    angles = np.vstack((calibration.pitch, calibration.yaw, calibration.c_p_static, calibration.c_p_total))
+    np.save(os.path.join(cache_location, 'angles.npy'), angles)
+    np.save(os.path.join(cache_location, 'c_p_locals.npy'), calibration.c_p_locals)
+    np.save(os.path.join(cache_location, 'sectors.npy'), calibration.sectors)
+    with open(os.path.join(cache_location, 'index.pkl'), 'wb') as file:
+        pickle.dump(calibration.sector_trees, file, protocol=pickle.HIGHEST_PROTOCOL)
+    meta_expected['c_p_labels'] = calibration.c_p_labels
+    with open(meta_location, 'w') as file:                  # written last so that partial caches are ignored
+        json.dump(meta_expected, file, indent=4)
+    calibration.cache_location = cache_location
+    print(f"cached calibration table in {cache_location}")
+    return calibration
+
+
+@monitored(rows=None)
+def import_calibration_surface(calibration_location, method, cache_directory):  # fitted spline coefficients only
+    calibration_hash = hash_file(calibration_location)
+    cache_location = os.path.join(cache_directory, f'surface_{calibration_hash[:16]}_{method}_stacked.pkl')
+    if os.path.exists(cache_location):
+        print(f"loading cached calibration surface from {cache_location}")
+        with open(cache_location, 'rb') as file:
+            return pickle.load(file)
+    df_calibration = import_csv_pandas(calibration_location)
+    calculate_total_and_static_pressure(df_calibration)
+    calculate_dimensionless_pressure(df_calibration)
+    surface = fit_calibration_surface(df_calibration, method)
+    os.makedirs(cache_directory, exist_ok=True)
+    with open(cache_location, 'wb') as file:
+        pickle.dump(surface, file, protocol=pickle.HIGHEST_PROTOCOL)
+    print(f"cached calibration surface in {cache_location}")
+    return surface
+
+
+@monitored(rows='result')
 def import_surrey_pandas(file_location):  # import surrey sensor data using pandas
     print(f"importing {file_location}")
     content = pd.read_csv(file_location, sep='\t', lineterminator='\r', skiprows=[1, -1])
     return content
 
 
-def combine_pressure_and_density(pressure_location, density_location, channels, channel_names=None):
+def import_surrey_numpy(file_location, columns, dtype=np.float64):  # import selected surrey sensor columns as arrays
+    print(f"importing {file_location}")
+    time_start = time.perf_counter()
+    with open(file_location, 'r', newline='') as file:
+        file.readline()                                             # column names
+        file.readline()                                             # blank second line
+        start_time = file.readline().split('\t')[0].strip()
+    if pyarrow is not None:
+        column_types = {column: pyarrow.from_numpy_dtype(np.dtype(dtype)) for column in columns}
+        table = pyarrow.csv.read_csv(
+            file_location, read_options=pyarrow.csv.ReadOptions(skip_rows_after_names=1),
+            parse_options=pyarrow.csv.ParseOptions(delimiter='\t', invalid_row_handler=lambda row: 'skip'),
+            convert_options=pyarrow.csv.ConvertOptions(include_columns=columns, column_types=column_types))
+        content = {column: table.column(column).to_numpy() for column in columns}
+    else:
+        data_frame = pd.read_csv(file_location, sep='\t', skiprows=[1], usecols=columns,
+                                 dtype={column: dtype for column in columns}, engine='c')
+        content = {column: data_frame[column].to_numpy() for column in columns}
+    complete = np.where(np.all([np.isfinite(content[column]) for column in columns], axis=0))[0]
+    n_rows = complete[-1] + 1 if len(complete) > 0 else 0          # drop an incomplete trailing record
+    for column in columns:
+        content[column] = content[column][:n_rows]
+    duration = max(time.perf_counter() - time_start, 1e-9)
+    size = os.path.getsize(file_location) / 1e6
+    print(f"parsed {n_rows} rows of {len(columns)} columns in {duration:.3f} s ({size / duration:.1f} MB/s)")
+    return start_time, content
+
+
+def surrey_log_columns(file_location):  # numeric columns named in the first line, without parsing the log
+    with open(file_location, 'r', newline='') as file:
+        names = file.readline().rstrip('\r\n').split('\t')
+    return [name for name in names[1:] if name != '']              # the record start time is kept as text
+
+
+def log_cache_location(file_location, cache_directory):  # one directory of binary columns per raw log
+    return os.path.join(cache_directory, os.path.splitext(os.path.basename(file_location))[0])
+
+
+def column_file_name(column):  # e.g. 'Density (kg/m^3)' is stored as Density_kg_m_3.npy
+    return re.sub(r'[^0-9A-Za-z]+', '_', column).strip('_') + '.npy'
+
+
+@monitored(rows=None)
+def ingest_surrey_log(file_location, cache_directory, dtype=np.float64, chunk_size=100000):  # raw log to .npy columns
+    cache_location = log_cache_location(file_location, cache_directory)
+    meta_location = os.path.join(cache_location, 'metadata.json')
+    log_stat = os.stat(file_location)
+    meta_expected = {'log_size': log_stat.st_size, 'log_mtime': log_stat.st_mtime_ns, 'dtype': np.dtype(dtype).name}
+
+    if os.path.exists(meta_location):
+        with open(meta_location, 'r') as file:
+            meta = json.load(file)
+        if all(meta.get(key) == value for key, value in meta_expected.items()):
+            return cache_location, meta
+        print(f"cached log in {cache_location} is out of date")
+
+    columns = surrey_log_columns(file_location)
+    with open(file_location, 'r', newline='') as file:
+        file.readline()                                             # column names
+        file.readline()                                             # blank second line
+        start_time = file.readline().split('\t')[0].strip()
+    os.makedirs(cache_location, exist_ok=True)
+    header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': (0,)}
+    files = {column: open(os.path.join(cache_location, column_file_name(column)), 'wb') for column in columns}
+    n_rows, times = 0, np.zeros(0)
+    try:
+        for file in files.values():                                 # the row count is filled in at the end
+            np.lib.format.write_array_header_1_0(file, header)
+        for content in import_surrey_chunks(file_location, columns, chunk_size, dtype):   # memory stays bounded
+            for column in columns:
+                files[column].write(np.ascontiguousarray(content[column], dtype=dtype).tobytes())
+            if len(times) < 2:                                      # the first two times give the sample rate
+                times = np.concatenate((times, content['t (s)'][:2 - len(times)]))
+            n_rows += len(content['t (s)'])
+        header['shape'] = (n_rows,)
+        for file in files.values():                                 # the header keeps its length as the shape grows
+            file.seek(0)
+            np.lib.format.write_array_header_1_0(file, header)
+    finally:
+        for file in files.values():
+            file.close()
+    meta_expected.update({'source': os.path.basename(file_location), 'start_time': start_time,
+                          'start_epoch': timestamp_to_epoch(start_time, '%d/%m/%Y %H:%M:%S'),
+                          'sample_rate': float(1 / (times[1] - times[0])) if len(times) > 1 else None,
+                          'n_rows': n_rows, 'columns': {column: column_file_name(column) for column in columns}})
+    with open(meta_location, 'w') as file:                  # written last so that partial caches are ignored
+        json.dump(meta_expected, file, indent=4)
+    print(f"cached {len(columns)} columns of {file_location} in {cache_location}")
+    return cache_location, meta_expected
+
+
+def import_surrey_cached(file_location, columns, cache_directory):  # memory-map selected columns of an ingested log
+    cache_location, meta = ingest_surrey_log(file_location, cache_directory)
+    missing = [column for column in columns if column not in meta['columns']]
+    if len(missing) > 0:
+        raise KeyError(f"{file_location} has no column {', '.join(missing)}")
+    print(f"mapping {len(columns)} columns of {file_location} from {cache_location}")
+    content = {column: np.load(os.path.join(cache_location, meta['columns'][column]), mmap_mode='r')
+               for column in columns}
+    return meta['start_time'], content
+
+
+shared_logs = dict()            # raw logs read on first use and shared by all devices of a run (run_scanner_pipeline)
+
+
+def share_surrey_log(file_location, columns, cache_directory=None):  # columns to read once when first requested
+    shared_logs[os.path.abspath(file_location)] = {'columns': list(columns), 'cache_directory': cache_directory,
+                                                   'start_time': None, 'content': None}
+
+
+def release_shared_logs():
+    shared_logs.clear()
+
+
+def import_surrey_columns(file_location, columns, cache_directory=None):  # parse the text log or map its cache
+    shared = shared_logs.get(os.path.abspath(file_location))
+    if shared is not None and all(column in shared['columns'] for column in columns):
+        if shared['content'] is None and shared['cache_directory'] is None:   # the first device reads for all
+            shared['start_time'], shared['content'] = import_surrey_numpy(file_location, shared['columns'])
+        elif shared['content'] is None:
+            shared['start_time'], shared['content'] = import_surrey_cached(file_location, shared['columns'],
+                                                                           shared['cache_directory'])
+        print(f"using {len(columns)} shared columns of {file_location}")
+        return shared['start_time'], {column: shared['content'][column] for column in columns}
+    if cache_directory is None:
+        return import_surrey_numpy(file_location, columns)
+    return import_surrey_cached(file_location, columns, cache_directory)
+
+
+def import_surrey_chunks(file_location, columns, chunk_size, dtype=np.float64):  # yield columns in blocks of rows
+    print(f"streaming {file_location} in chunks of {chunk_size} rows")
+    reader = pd.read_csv(file_location, sep='\t', skiprows=[1], usecols=columns,
+                         dtype={column: dtype for column in columns}, engine='c', chunksize=chunk_size)
+    content = None
+    for chunk in reader:                                            # look one chunk ahead to find the last one
+        if content is not None:
+            yield content
+        content = {column: chunk[column].to_numpy() for column in columns}
+    if content is not None:
+        complete = np.where(np.all([np.isfinite(content[column]) for column in columns], axis=0))[0]
+        n_rows = complete[-1] + 1 if len(complete) > 0 else 0      # drop an incomplete trailing record
+        yield {column: content[column][:n_rows] for column in columns}
+
+
+def create_combined_frame(start_epoch, pressure, density, density_offset, channel_names, row_offset=0, timestamps=True,
+                          alignment='hold'):
+    n_samples = len(pressure['t (s)'])
+    density_values, temperature_values = align_to_times(
+        density['t (s)'] + density_offset, [density['Density (kg/m^3)'], density['Thermistor (degC)']],
+        pressure['t (s)'], alignment)                               # density log on the pressure sample times
+    columns = dict()
+    columns['time', '(s)'] = pressure['t (s)']
+    columns['epoch', '(s)'] = pressure['t (s)'] + start_epoch
+    if timestamps is True:                                          # per-sample date and time of each record
+        columns['timestamp', '(date time)'] = epochs_to_timestamps(columns['epoch', '(s)'])
+    columns['density', '(kg/m^3)'] = density_values
+    columns['temperature', '(deg C)'] = temperature_values
+    for channel_name, pressure_column in zip(channel_names, list(pressure)[1:]):
+        columns[f'{channel_name}', '(Pa)'] = pressure[pressure_column]
+    df_combined = pd.DataFrame(columns, index=pd.RangeIndex(row_offset, row_offset + n_samples))
+    return df_combined
+
+
+@monitored(rows='result')
+def combine_pressure_and_density(pressure_location, density_location, channels, channel_names=None, timestamps=True,
+                                 cache_directory=None, alignment='hold'):
 
     print("combining pressure and density data")
-    df_pressure = import_surrey_pandas(pressure_location)
-    df_density = import_surrey_pandas(density_location)
-    start_time = df_pressure['Record start time'][1].strip('\n')
+    pressure_columns = ['t (s)'] + [f'P{channel} (Pa)' for channel in channels]
+    density_columns = ['t (s)', 'Density (kg/m^3)', 'Thermistor (degC)']
+    start_time, pressure = import_surrey_columns(pressure_location, pressure_columns, cache_directory)
+    density_start_time, density = import_surrey_columns(density_location, density_columns, cache_directory)
     start_epoch = timestamp_to_epoch(start_time, '%d/%m/%Y %H:%M:%S')
-    sample_ratio = df_density['t (s)'][1] / df_pressure['t (s)'][1]
-    trim = int(len(df_pressure['t (s)']) - len(df_density['t (s)']) * sample_ratio)
-
-    trim_p, trim_d = -1, -1
-    if trim > 0:
-        trim_p, trim_d = -1 - trim, -1
-    elif trim < 0:
-        trim_p, trim_d = -1, -1 + trim
-
-    df_combined = pd.DataFrame()
-    df_combined['time'] = df_pressure['t (s)'][0:trim_p]
-    df_combined.columns = pd.MultiIndex.from_product([df_combined.columns, ['(s)']])    # initialise multi-index
-    df_combined['time', '(s)'] = df_pressure['t (s)'][0:trim_p]
-    df_combined['epoch', '(s)'] = df_pressure['t (s)'][0:trim_p] + start_epoch
-    df_combined.epoch = df_pressure['t (s)'][0:trim_p] + start_epoch
-
-    print("creating correct timestamps")
-    """
-    timestamps = np.array(list())
-    for epoch in df_combined['epoch', '(s)']:
-        timestamps = np.append(timestamps, epoch_to_timestamp(epoch))
-    """
-    timestamps = [f"{start_time}" for x in range(len(df_combined['time']))]
-    df_combined['timestamp', '(date time)'] = timestamps
-    df_combined['density', '(kg/m^3)'] \
-        = np.array(df_density['Density (kg/m^3)']).repeat(sample_ratio, axis=0)[0:trim_d]
-    df_combined['temperature', '(deg C)'] \
-        = np.array(df_density['Thermistor (degC)']).repeat(sample_ratio, axis=0)[0:trim_d]
+    density_offset = timestamp_to_epoch(density_start_time, '%d/%m/%Y %H:%M:%S') - start_epoch
+    first, end = find_covered_samples(density['t (s)'] + density_offset, pressure['t (s)'])
+    if first > 0:
+        print(f"WARNING: the density log starts {round(density_offset, 2)} seconds after the pressure log, "
+              f"dropping the first {first} samples")
     if channel_names is None:
-        for channel in channels:
-            df_combined[f'P{channel}', '(Pa)'] = df_pressure[f'P{channel} (Pa)'][0:trim_p]
-    else:
-        for channel_name, channel in zip(channel_names, channels):
-            df_combined[f'{channel_name}', '(Pa)'] = df_pressure[f'P{channel} (Pa)'][0:trim_p]
+        channel_names = [f'P{channel}' for channel in channels]
+
+    print("creating correct timestamps" if timestamps is True else "combining without timestamps")
+    pressure = {column: pressure[column][first:end] for column in pressure_columns}
+    df_combined = create_combined_frame(start_epoch, pressure, density, density_offset, channel_names,
+                                        timestamps=timestamps, alignment=alignment)
     return df_combined
 
 
+def combine_pressure_and_density_chunks(pressure_location, density_location, channels, chunk_size,
+                                        channel_names=None, timestamps=True, cache_directory=None,
+                                        alignment='hold'):  # yield the combined data in blocks
+    print("combining pressure and density data in chunks")
+    pressure_columns = ['t (s)'] + [f'P{channel} (Pa)' for channel in channels]
+    density_columns = ['t (s)', 'Density (kg/m^3)', 'Thermistor (degC)']
+    chunk_size = max(int(chunk_size), 2)
+    if cache_directory is None and os.path.abspath(pressure_location) not in shared_logs:
+        with open(pressure_location, 'r', newline='') as file:
+            file.readline()                                         # column names
+            file.readline()                                         # blank second line
+            start_time = file.readline().split('\t')[0].strip()
+        pressure_chunks = import_surrey_chunks(pressure_location, pressure_columns, chunk_size)
+    else:                                                           # slices of the shared or mapped columns
+        start_time, pressure_mapped = import_surrey_columns(pressure_location, pressure_columns, cache_directory)
+        pressure_chunks = ({column: values[start:start + chunk_size] for column, values in pressure_mapped.items()}
+                           for start in range(0, len(pressure_mapped['t (s)']), chunk_size))
+    density_start_time, density = import_surrey_columns(density_location, density_columns, cache_directory)
+    start_epoch = timestamp_to_epoch(start_time, '%d/%m/%Y %H:%M:%S')
+    density_offset = timestamp_to_epoch(density_start_time, '%d/%m/%Y %H:%M:%S') - start_epoch
+    if channel_names is None:
+        channel_names = [f'P{channel}' for channel in channels]
+
+    row_offset = 0
+    for pressure in pressure_chunks:
+        n_chunk = len(pressure['t (s)'])
+        first, end = find_covered_samples(density['t (s)'] + density_offset, pressure['t (s)'])
+        if end > first:                                             # chunks before the density log are dropped
+            pressure = {column: pressure[column][first:end] for column in pressure_columns}
+            yield create_combined_frame(start_epoch, pressure, density, density_offset, channel_names, row_offset,
+                                        timestamps, alignment)
+            row_offset += end - first
+        if end < n_chunk:                                           # the density log ends within this chunk
+            break
+
+
+# -------------------- functions for incremental re-runs  -------------------- #
+
+def force_recompute():  # '--force' on the command line recomputes all stages
+    return '--force' in sys.argv
+
+
+def stage_parameters(module, names):  # the subset of control parameters a stage depends on
+    parameters = {name: getattr(module, name) for name in names}
+    return json.loads(json.dumps(parameters, default=str))      # tuples and numpy values as stored in the manifest
+
+
+def file_signature(file_location, previous=None):  # skip hashing when size and modification time are unchanged
+    status = os.stat(file_location)
+    signature = {'size': status.st_size, 'mtime': status.st_mtime}
+    if previous is not None and previous.get('size') == status.st_size and previous.get('mtime') == status.st_mtime:
+        signature['sha256'] = previous['sha256']
+    else:
+        signature['sha256'] = hash_file(file_location)
+    return signature
+
+
+def stage_manifest_location(experimental_directory, stage):
+    return os.path.join(experimental_directory, f'manifest_{stage}.json')
+
+
+def stage_is_current(experimental_directory, stage, inputs, parameters, outputs):
+    manifest_location = stage_manifest_location(experimental_directory, stage)
+    if force_recompute() is True or not os.path.exists(manifest_location):
+        return False
+    with open(manifest_location, 'r') as file:
+        manifest = json.load(file)
+    if manifest.get('parameters') != parameters:
+        print(f"parameters of stage {stage} changed since the last run")
+        return False
+    if sorted(manifest.get('outputs', list())) != sorted(outputs) or not all(os.path.exists(o) for o in outputs):
+        print(f"outputs of stage {stage} are missing")
+        return False
+    recorded = manifest.get('inputs', dict())
+    if sorted(recorded) != sorted(inputs) or not all(os.path.exists(i) for i in inputs):
+        return False
+    for input_location in inputs:
+        if file_signature(input_location, recorded[input_location])['sha256'] != recorded[input_location]['sha256']:
+            print(f"input {input_location} of stage {stage} changed since the last run")
+            return False
+    print(f"stage {stage} is up to date and is skipped (use --force to recompute)")
+    return True
+
+
+def record_stage(experimental_directory, stage, inputs, parameters, outputs):
+    manifest_location = stage_manifest_location(experimental_directory, stage)
+    previous = dict()
+    if os.path.exists(manifest_location):                           # reuse hashes of unchanged inputs
+        with open(manifest_location, 'r') as file:
+            previous = json.load(file).get('inputs', dict())
+    manifest = {'stage': stage, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'parameters': parameters,
+                'inputs': {location: file_signature(location, previous.get(location)) for location in inputs},
+                'outputs': list(outputs)}
+    os.makedirs(experimental_directory, exist_ok=True)
+    with open(manifest_location, 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+
 # -------------------- functions for exporting data  -------------------- #
 
 
@@ -77,68 +444,187 @@ def create_new_directory(directory):
         print("Successfully created the new directory %s " % path)
 
 
-def export_data_csv(data_frame, file_name):
-    row_0, row_1 = str(), str()
-    for index, header in enumerate(list(data_frame.columns)):
-        row_0 = row_0 + str(header[0]) + ','
-        row_1 = row_1 + str(header[1]) + ','
-    row_0 = row_0.rstrip(row_0[-1]) + "\n"
-    row_1 = row_1.rstrip(row_1[-1]) + "\n"
-    with open(file_name, 'w', encoding='utf-8-sig') as file:
-        file.write(row_0)
-        file.write(row_1)
-    data_frame.to_csv(file_name, index=False, header=False, encoding='utf-8', mode='a')
+def format_csv_column(series, precision=None):  # return the printf format and the values of one column
+    values = series.to_numpy()
+    if values.dtype.kind == 'f':
+        number_format = '%r' if precision is None else f'%.{int(precision)}g'
+        if not np.isnan(values).any():
+            return number_format, values.tolist()
+        return '%s', ['' if value != value else number_format % value for value in values.tolist()]
+    if values.dtype.kind in 'iu':
+        return '%d', values.tolist()
+    if values.dtype.kind in 'mM':
+        values = series.astype(str).to_numpy()
+    strings = ['' if value is None or value != value else str(value) for value in values.tolist()]
+    for index, string in enumerate(strings):                        # quote text like DataFrame.to_csv does
+        if ',' in string or '"' in string or '\n' in string:
+            strings[index] = '"' + string.replace('"', '""') + '"'
+    return '%s', strings
+
+
+@monitored()
+def export_data_csv(data_frame, file_name, append=False, precision=None, compress=False, chunk_size=50000):
+    if compress is True and not file_name.endswith('.gz'):
+        file_name = f'{file_name}.gz'
+    mode, encoding = ('a', 'utf-8') if append is True else ('w', 'utf-8-sig')
+    if file_name.endswith('.gz'):
+        file = gzip.open(file_name, mode + 't', compresslevel=6, encoding=encoding, newline='')
+    else:
+        file = open(file_name, mode, encoding=encoding, newline='')
+    with file:
+        if append is False:                                         # two header rows with variables and units
+            file.write(','.join(str(header[0]) for header in data_frame.columns) + '\n')
+            file.write(','.join(str(header[1]) for header in data_frame.columns) + '\n')
+        n_rows, n_columns = data_frame.shape
+        progress = ProgressReporter(f"exporting {os.path.basename(file_name)}", n_rows)
+        for start in range(0, n_rows, chunk_size):                 # format each block of rows in one operation
+            block = data_frame.iloc[start:start + chunk_size]
+            formats, values = list(), [None] * (len(block) * n_columns)
+            for column in range(n_columns):
+                column_format, values[column::n_columns] = format_csv_column(block.iloc[:, column], precision)
+                formats.append(column_format)
+            file.write((','.join(formats) + '\n') * len(block) % tuple(values))
+            progress.update(len(block))
+        progress.close()
     print(f"successfully exported data to {file_name}")
+    return file_name
 
 
-def log_printer_to_csv(df_combined, printer_log_location):
-    with open(printer_log_location, 'r') as file:           # search file for sampling date
-        for line in file:
-            if line.count("-") >= 3:
-                print("analysing printer locations using new format")
-                buffer = [1.5, 1.5]
-                df_printer = log_printer_to_csv_new(buffer, printer_log_location)
+@monitored()
+def export_data_columnar(data_frame, file_name):  # export to feather or parquet, keeping the units as metadata
+    variables = [str(header[0]) for header in data_frame.columns]
+    units = {str(header[0]): str(header[1]) for header in data_frame.columns}
+    content = pd.DataFrame({variable: data_frame.iloc[:, column] for column, variable in enumerate(variables)})
+    table = pyarrow.Table.from_pandas(content, preserve_index=False)
+    table = table.replace_schema_metadata({b'units': json.dumps(units).encode('utf-8')})
+    if file_name.endswith('.parquet'):
+        pyarrow.parquet.write_table(table, file_name)
+    else:
+        pyarrow.feather.write_feather(table, file_name)
+    print(f"successfully exported data to {file_name}")
+    return file_name
+
+
+@monitored(rows=None)
+def export_calibration_table(surface, point_grid, file_name, block_size=200000):  # evaluate the table in blocks
+    rows_per_block = max(1, int(block_size) // point_grid.n_columns)
+    names = surface.names
+    print(f"exporting {point_grid.n_points} interpolated calibration points in blocks of {rows_per_block} rows")
+    progress = ProgressReporter("exporting interpolated calibration points", point_grid.n_points, 'points')
+    for row_start in range(0, point_grid.n_rows, rows_per_block):
+        row_end = min(row_start + rows_per_block, point_grid.n_rows)
+        xy_block = point_grid.xy_rows(row_start, row_end)
+        columns = {('yaw', '(deg)'): xy_block[:, 1], ('pitch', '(deg)'): xy_block[:, 0]}
+        data_pivots = surface.evaluate_grid_channels(point_grid.x_coord, point_grid.y_coord[row_start:row_end])
+        for channel, name in enumerate(names):                      # all channels of a block in one evaluation
+            columns[name, surface.units[name]] = data_pivots[:, :, channel].flatten()
+        c_p_locals = np.column_stack([columns[label, surface.units[label]] for label in surface.c_p_labels])
+        columns['sector', '(hole)'] = np.argmin(c_p_locals, axis=1) + 1    # port reading the highest pressure
+        export_data_csv(pd.DataFrame(columns), file_name, append=row_start > 0)
+        progress.update(xy_block.shape[0])
+    progress.close()
+    return file_name
+
+
+def export_intermediate(data_frame, file_location, file_format='csv', precision=None, compress=False):
+    if file_format == 'csv' or pyarrow is None:                     # csv remains available without pyarrow
+        return export_data_csv(data_frame, file_location, False, precision, compress)
+    return export_data_columnar(data_frame, intermediate_location(file_location, file_format))
+
+
+class IntermediateWriter:  # Append chunks of data to one intermediate file
+    def __init__(self, file_location, file_format='csv', precision=None, compress=False):
+        self.file_format = file_format if pyarrow is not None else 'csv'
+        self.file_location = intermediate_location(file_location, self.file_format)
+        self.precision, self.compress = precision, compress
+        self.writer, self.schema = None, None
+        self.n_rows = 0
+
+    def write(self, data_frame):
+        if self.file_format == 'csv':
+            self.file_location = export_data_csv(data_frame, self.file_location, self.n_rows > 0, self.precision,
+                                                 self.compress)
+            self.n_rows += data_frame.shape[0]
+            return
+        variables = [str(header[0]) for header in data_frame.columns]
+        content = pd.DataFrame({variable: data_frame.iloc[:, column] for column, variable in enumerate(variables)})
+        table = pyarrow.Table.from_pandas(content, preserve_index=False)
+        if self.writer is None:                                     # the first chunk defines the file schema
+            units = {str(header[0]): str(header[1]) for header in data_frame.columns}
+            self.schema = table.schema.with_metadata({b'units': json.dumps(units).encode('utf-8')})
+            if self.file_format == 'parquet':
+                self.writer = pyarrow.parquet.ParquetWriter(self.file_location, self.schema)
             else:
-                print("analysing printer locations using old format")
-                buffer = [2, 2]
-                date = df_combined['timestamp', '(date time)'][0].split(" ")[0]
-                df_printer = log_printer_to_csv_old(buffer, printer_log_location, date)
-            break
-    return df_printer
+                self.writer = pyarrow.ipc.new_file(self.file_location, self.schema)
+        self.writer.write_table(table.cast(self.schema))
+        self.n_rows += data_frame.shape[0]
 
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        print(f"successfully exported {self.n_rows} rows to {self.file_location}")
 
-def log_printer_to_csv_new(buffer, printer_log_location):
-    date_format = '%Y-%m-%d %H:%M:%S.%f'
-    with open(printer_log_location, 'r') as file:           # search file for sampling time
-        for line in file:
-            if line.find("sampling time") > -1:
-                text = str(line).replace('\"', '').split()
-                sampling_time = float(text[-1])
-                break
 
-    buffer_start, buffer_end = buffer[0], buffer[1]
+PRINTER_LOG_PATTERN = re.compile(      # one alternation per record type so the log is scanned only once
+    r'^(?P<stamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}[,.]\d+)?[^\n]*?'
+    r'(?:sampling time\s*=\s*(?P<sampling>[\d.]+)'
+    r'|Print started at:\s*(?P<started>\d{1,2}:\d{2}:\d{2})'
+    r'|X\s*=\s*(?P<x>-?[\d.]+),?\s*Z\s*=\s*(?P<z>-?[\d.]+)'
+    r'|Print time:\s*(?:(?P<hours>\d+)h\s*)?(?:(?P<minutes>\d+)m\s*)?(?P<seconds>[\d.]+)s)', re.MULTILINE)
+
+
+def read_printer_log(printer_log_location):
     with open(printer_log_location, 'r') as file:
-        for line in file:
-            if line.find("X = ") > -1:
-                text = str(line).replace('\"', '').replace(', ', ' ').replace(',', '.').split()
-                start_epoch = timestamp_to_epoch(f"{text[0]} {text[1]}", date_format)
-                break
-
-    with open(printer_log_location, 'r') as file:           # search file for data coordinates and times
-        printer_x, printer_z = np.array(list()), np.array(list())
-        epoch_starts, epoch_ends, durations = np.array(list()), np.array(list()), np.array(list())
-        for line in file:
-            if line.find("X = ") > -1:                      # search for x and z coordinates
-                text = str(line).replace('\"', '').replace(', ', ' ').replace(',', '.').split()
-                printer_x = np.append(printer_x, text[-4])
-                printer_z = np.append(printer_z, text[-1])
-                epoch = timestamp_to_epoch(f"{text[0]} {text[1]}", date_format)
-                epoch_start = epoch + buffer_start
-                epoch_end = epoch + sampling_time - buffer_end
-                duration = sampling_time
-                epoch_starts = np.append(epoch_starts, epoch_start)
-                epoch_ends = np.append(epoch_ends, epoch_end)
-                durations = np.append(durations, duration)
+        text = file.read()
+    first_line = text[:text.find('\n')] if '\n' in text else text
+    log = {'new_format': first_line.count("-") >= 3, 'sampling_time': None, 'start_time': None}
+    stamps, printer_x, printer_z, print_times = list(), list(), list(), list()
+    for match in PRINTER_LOG_PATTERN.finditer(text):
+        if match.group('x') is not None:                    # coordinates of a traverse point
+            stamps.append(match.group('stamp'))
+            printer_x.append(match.group('x'))
+            printer_z.append(match.group('z'))
+        elif match.group('seconds') is not None:            # printer clock at a traverse point
+            hours, minutes = match.group('hours') or 0, match.group('minutes') or 0
+            print_times.append(float(hours) * 3600 + float(minutes) * 60 + float(match.group('seconds')))
+        elif match.group('sampling') is not None and log['sampling_time'] is None:
+            log['sampling_time'] = float(match.group('sampling'))
+        elif match.group('started') is not None and log['start_time'] is None:
+            log['start_time'] = match.group('started')
+    log['probe_x'] = np.array(printer_x, dtype=float)
+    log['probe_y'] = np.array(printer_z, dtype=float)
+    log['print_times'] = np.array(print_times, dtype=float)
+    if log['new_format']:                                   # convert all time stamps in one call
+        date_times = pd.to_datetime(pd.Series(stamps).str.replace('.', ',', regex=False),
+                                    format='%Y-%m-%d %H:%M:%S,%f')
+        log['epochs'] = date_times.values.astype('datetime64[us]').astype(np.int64) / 1e6
+    return log
+
+
+@monitored(rows='result')
+def log_printer_to_csv(df_combined, printer_log_location):
+    printer_log = read_printer_log(printer_log_location)
+    if printer_log['new_format']:
+        print("analysing printer locations using new format")
+        buffer = [1.5, 1.5]
+        df_printer = log_printer_to_csv_new(buffer, printer_log_location, printer_log)
+    else:
+        print("analysing printer locations using old format")
+        buffer = [2, 2]
+        date = epoch_to_timestamp(df_combined['epoch', '(s)'].iloc[0]).split(" ")[0]
+        df_printer = log_printer_to_csv_old(buffer, printer_log_location, date, printer_log)
+    return df_printer
+
+
+def log_printer_to_csv_new(buffer, printer_log_location, printer_log=None):
+    if printer_log is None:
+        printer_log = read_printer_log(printer_log_location)
+    sampling_time, epochs = printer_log['sampling_time'], printer_log['epochs']
+    buffer_start, buffer_end = buffer[0], buffer[1]
+    start_epoch = epochs[0]                                 # first traverse point defines the time origin
+    epoch_starts = epochs + buffer_start
+    epoch_ends = epochs + sampling_time - buffer_end
+    durations = np.full(epochs.shape[0], sampling_time)
     starts, ends = epoch_starts - start_epoch, epoch_ends - start_epoch
 
     df_printer = pd.DataFrame()
@@ -147,49 +633,19 @@ def log_printer_to_csv_new(buffer, printer_log_location):
     df_printer['duration', '(s)'] = durations
     df_printer['epoch_start', '(s)'] = epoch_starts
     df_printer['epoch_end', '(s)'] = epoch_ends
-    df_printer['probe_x', '(mm)'] = printer_x
-    df_printer['probe_y', '(mm)'] = printer_z
+    df_printer['probe_x', '(mm)'] = printer_log['probe_x']
+    df_printer['probe_y', '(mm)'] = printer_log['probe_y']
     return df_printer
 
 
-def log_printer_to_csv_old(buffer, printer_log_location, date):
-
-    found_sampling_time, found_start_time = False, False
-    with open(printer_log_location, 'r') as file:           # search file for sampling time
-        for line in file:
-            if found_sampling_time is True and found_start_time is True:
-                break
-            if found_sampling_time is False and line.find("sampling time") > -1:
-                text = str(line).replace('\"', '').split()
-                sampling_time = float(text[-1])
-                found_sampling_time = True
-            if found_start_time is False and line.find("Print started at:") > -1:
-                text = str(line).replace('\"', '').split()
-                start_time = text[-1]
-                found_start_time = True
-
+def log_printer_to_csv_old(buffer, printer_log_location, date, printer_log=None):
+    if printer_log is None:
+        printer_log = read_printer_log(printer_log_location)
+    sampling_time, start_time = printer_log['sampling_time'], printer_log['start_time']
     buffer_start, buffer_end = buffer[0], buffer[1]
-    with open(printer_log_location, 'r') as file:           # search file for data coordinates and times
-        printer_x, printer_z = np.array(list()), np.array(list())
-        starts, ends, durations = np.array(list()), np.array(list()), np.array(list())
-        for line in file:
-            if line.find("X = ") > -1:  # search for x and z coordinates
-                text = str(line).replace('\"', '').replace(',', '').split()
-                printer_x = np.append(printer_x, text[-4])
-                printer_z = np.append(printer_z, text[-1])
-            if line.find("Print time:") > -1:  # search for printer time stamps
-                text = str(line).replace('m', '').replace('s', '').split()
-                try:
-                    minutes = float(text[-2])
-                except:
-                    minutes = float(0)
-                seconds = float(text[-1])
-                start = minutes * 60 + seconds + buffer_start
-                end = minutes * 60 + seconds + sampling_time - buffer_end
-                duration = end - start
-                starts = np.append(starts, start)
-                ends = np.append(ends, end)
-                durations = np.append(durations, duration)
+    starts = printer_log['print_times'] + buffer_start
+    ends = printer_log['print_times'] + sampling_time - buffer_end
+    durations = ends - starts
     epoch = timestamp_to_epoch(str(date + " " + start_time), '%d/%m/%Y %H:%M:%S')
     epoch_starts, epoch_ends = starts + epoch, ends + epoch
 
@@ -199,7 +655,7 @@ def log_printer_to_csv_old(buffer, printer_log_location, date):
     df_printer['duration', '(s)'] = durations
     df_printer['epoch_start', '(s)'] = epoch_starts
     df_printer['epoch_end', '(s)'] = epoch_ends
-    df_printer['probe_x', '(mm)'] = printer_x
-    df_printer['probe_y', '(mm)'] = printer_z
+    df_printer['probe_x', '(mm)'] = printer_log['probe_x']
+    df_printer['probe_y', '(mm)'] = printer_log['probe_y']
     return df_printer
 # end of code
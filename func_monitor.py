@@ -0,0 +1,197 @@
+"""This Python module contains a set of functions to record the wall time, peak memory use and number of rows of each
+processing stage, to report the progress of long loops and to export a summary of each run"""
+
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import functools
+import contextlib
+import multiprocessing
+try:                            # peak memory of the process is not available on every platform
+    import resource
+except ImportError:
+    resource = None
+
+
+def reset_peak_memory():  # linux allows the peak of a process to be reset, so that each stage reports its own peak
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_memory_mb(children=False):  # peak resident memory in MB (since the last reset where supported)
+    if children is False:
+        try:
+            with open('/proc/self/status', 'r') as file:
+                for line in file:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children is True else resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024     # bytes on macOS, kB elsewhere
+
+
+def fork_context():  # worker processes inherit the parent instead of re-running its script (None where unavailable)
+    if not sys.platform.startswith('linux'):       # forking after macOS frameworks are set up can crash the child
+        return None
+    return multiprocessing.get_context('fork')
+
+
+def count_rows(value):  # rows of a data frame or array, entries of a list
+    if hasattr(value, 'shape') and len(value.shape) > 0:
+        return int(value.shape[0])
+    if isinstance(value, (list, tuple)):
+        return len(value)
+    return None
+
+
+class RunMonitor:  # Collect the stages of one run script, aggregated by their position in the call tree
+    def __init__(self):
+        self.reset()
+
+    def reset(self, script=None, progress_interval=5.0):
+        self.script = script
+        self.progress_interval = progress_interval
+        self.started, self.time_start = datetime.datetime.now(), time.perf_counter()
+        self.stages = dict()
+        self.active = list()                                        # stack of the stages currently running
+        self.peak = None
+
+    def observe_peak(self, record=None):  # fold the current peak into the open stage before it is reset
+        peak = peak_memory_mb()
+        if peak is not None:
+            if record is not None:
+                record['peak'] = max(record['peak'] or 0, peak)
+            self.peak = max(self.peak or 0, peak)
+        return peak
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        parent = self.active[-1] if len(self.active) > 0 else None
+        self.observe_peak(parent)
+        path = name if parent is None else f"{parent['path']}/{name}"
+        record = {'name': name, 'path': path, 'rows': rows, 'peak': None, 'exact': reset_peak_memory()}
+        self.stages.setdefault(path, {                               # listed in the order the stages start
+            'stage': name, 'path': path, 'depth': path.count('/'), 'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+            'rows': None, 'peak_rss_mb': None, 'peak_exact': record['exact'], 'failed': 0})
+        self.active.append(record)
+        time_start = time.perf_counter()
+        failed = False
+        try:
+            yield record
+        except BaseException:              # only an exception leaving this stage marks it failed
+            failed = True
+            raise
+        finally:
+            seconds = time.perf_counter() - time_start
+            self.active.pop()
+            self.observe_peak(record)
+            if parent is not None and record['peak'] is not None:  # the parent's peak includes its children
+                parent['peak'] = max(parent['peak'] or 0, record['peak'])
+            self.add(record, seconds, failed)
+
+    def add(self, record, seconds, failed=False):
+        entry = self.stages[record['path']]
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+        entry['max_seconds'] = max(entry['max_seconds'], seconds)
+        entry['failed'] += int(failed)
+        if record['rows'] is not None:
+            entry['rows'] = (entry['rows'] or 0) + int(record['rows'])
+        if record['peak'] is not None:
+            entry['peak_rss_mb'] = max(entry['peak_rss_mb'] or 0, round(record['peak'], 1))
+
+    def report(self):
+        self.observe_peak()
+        wall_time = time.perf_counter() - self.time_start
+        stages = [dict(entry) for entry in self.stages.values()]
+        for entry in stages:
+            entry['seconds'], entry['max_seconds'] = round(entry['seconds'], 4), round(entry['max_seconds'], 4)
+            entry['rows_per_second'] = None
+            if entry['rows'] is not None and entry['seconds'] > 0:
+                entry['rows_per_second'] = round(entry['rows'] / entry['seconds'], 1)
+            entry['share'] = round(entry['seconds'] / max(wall_time, 1e-9), 4)
+        peak_children = peak_memory_mb(children=True)
+        return {'script': self.script, 'arguments': sys.argv[1:],
+                'started': self.started.isoformat(timespec='seconds'), 'wall_seconds': round(wall_time, 3),
+                'peak_rss_mb': round(self.peak, 1) if self.peak else None,
+                'peak_rss_children_mb': round(peak_children, 1) if peak_children else None,
+                'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                'stages': stages}
+
+
+monitor = RunMonitor()          # one monitor per process, restarted by each run script
+
+
+def monitored(rows='argument'):  # record every call of a function as a stage of the current run
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with monitor.stage(function.__name__) as record:
+                result = function(*args, **kwargs)
+                if rows == 'result':
+                    record['rows'] = count_rows(result)
+                elif rows == 'argument' and len(args) > 0:
+                    record['rows'] = count_rows(args[0])
+            return result
+        return wrapper
+    return decorator
+
+
+class ProgressReporter:  # Report the progress of a long loop at most once per interval
+    def __init__(self, label, total=None, unit='rows', interval=None):
+        self.label, self.total, self.unit = label, total, unit
+        self.interval = monitor.progress_interval if interval is None else interval
+        self.count, self.messages = 0, 0
+        self.time_start = self.time_reported = time.perf_counter()
+
+    def update(self, count=1):
+        self.count += count
+        if self.interval is None:
+            return
+        now = time.perf_counter()
+        if now - self.time_reported >= self.interval:
+            self.time_reported = now
+            self.messages += 1
+            print(self.message(now))
+
+    def message(self, now):
+        rate = self.count / max(now - self.time_start, 1e-9)
+        if self.total is None or self.total == 0:
+            return f"{self.label}: {self.count} {self.unit} ({rate:.0f} {self.unit}/s)"
+        remaining = (self.total - self.count) / max(rate, 1e-9)
+        return (f"{self.label}: {self.count} of {self.total} {self.unit} ({100 * self.count / self.total:.0f} %, "
+                f"{rate:.0f} {self.unit}/s, {remaining:.0f} s remaining)")
+
+    def close(self):  # short loops stay silent, long ones confirm that they finished
+        if self.messages > 0:
+            print(self.message(time.perf_counter()))
+
+
+def start_run(script, progress_interval=5.0):  # called at the top of each run script
+    monitor.reset(script, progress_interval)
+
+
+def export_run_report(directory, name=None):  # summary of all stages next to the outputs of the run
+    report = monitor.report()
+    os.makedirs(directory, exist_ok=True)
+    file_name = os.path.join(directory, f"run_report_{monitor.script}{'' if name is None else '_' + name}.json")
+    with open(file_name, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"run took {report['wall_seconds']:.1f} s with a peak memory use of {report['peak_rss_mb']} MB")
+    for entry in sorted(report['stages'], key=lambda stage: -stage['seconds'])[0:5]:
+        print(f"    {entry['path']:<60}{entry['seconds']:>9.2f} s {entry['calls']:>6} calls "
+              f"{str(entry['peak_rss_mb']):>9} MB")
+    print(f"successfully exported run report to {file_name}")
+    return file_name
+
+# end of code
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""This Python script runs one of the processing pipelines for several measurement directories in parallel. Each run
+is carried out in its own process with its own file locations, and its console output is written to a log file"""
+
+import os
+import sys
+import time
+import runpy
+import importlib
+import traceback
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import var_locations
+import var_variables
+
+pipelines = {'multi_hole': (['run_multi_hole_velocity.py', 'run_multi_hole_field.py'],
+                            ['log_pressure.txt', 'log_additional.txt', 'log_printer.txt']),
+             'pitot_rake': (['run_pitot_rake_velocity.py', 'run_pitot_rake_field.py'],
+                            ['log_pressure.txt', 'log_additional.txt', 'log_printer.txt']),
+             'pressure_taps': (['run_pressure_tap_time_frames.py'], ['log_pressure.txt', 'log_additional.txt']),
+             'scanner': (['run_scanner_pipeline.py'], ['log_pressure.txt', 'log_additional.txt'])}
+
+
+def find_measurement_directories(measured_directory, required_logs):
+    directories = list()
+    for name in sorted(os.listdir(measured_directory)):
+        path = os.path.join(measured_directory, name)
+        if os.path.isdir(path) and all(os.path.exists(os.path.join(path, log)) for log in required_logs):
+            directories.append(name)
+    return directories
+
+
+def warm_calibration_cache():  # build the binary calibration index once so workers only map it read-only
+    from func_import_export import import_calibration_table, import_calibration_surface
+    sizes = [var_variables.interp_size_coarse]
+    files = [var_locations.interpolation_file_coarse]
+    if var_variables.angle_solver != 'surface':
+        sizes.append(var_variables.interp_size_fine)
+        files.append(var_locations.interpolation_file_fine)
+    else:
+        import_calibration_surface(var_locations.calibration_input_file, var_variables.interpolation_method,
+                                   var_locations.calibration_cache_directory)
+    for interpolation_file, interp_size in zip(files, sizes):
+        import_calibration_table(interpolation_file, var_locations.calibration_input_file, interp_size,
+                                 var_locations.calibration_cache_directory)
+
+
+def process_directory(time_directory, scripts, arguments, limit_workers=False):  # executed in a worker process
+    os.environ['PRESSURE_TIME_DIRECTORY'] = time_directory
+    locations = importlib.reload(var_locations)                     # file locations of this measurement
+    os.makedirs(locations.experimental_directory, exist_ok=True)
+    log_file = os.path.join(locations.experimental_directory, f'batch_{time_directory}.log')
+    start, message = time.time(), None
+    with open(log_file, 'w') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        for script in scripts:
+            variables = importlib.reload(var_variables)             # scripts modify some of its lists in place
+            if limit_workers is True:                               # the batch already keeps every core busy
+                variables.figure_workers, variables.angle_workers = 1, 1
+            print(f"---------- {script} ----------")
+            sys.argv = [script] + arguments
+            try:
+                runpy.run_path(script, run_name='__main__')
+            except BaseException as error:                          # includes exit() called by a script
+                traceback.print_exc()
+                message = f"{script} failed with {type(error).__name__}: {error}"
+                break
+    return time_directory, time.time() - start, message, log_file
+
+
+if __name__ == '__main__':
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))            # run scripts use relative file locations
+    arguments = [argument for argument in sys.argv[1:] if argument.startswith('--')]   # passed on to the scripts
+    options = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    pipeline = options[0] if len(options) > 0 else var_variables.batch_pipeline
+    if pipeline not in pipelines:
+        raise ValueError(f"unknown pipeline '{pipeline}', choose from {', '.join(pipelines)}")
+    scripts, required_logs = pipelines[pipeline]
+    directories = options[1:] if len(options) > 1 else var_variables.batch_directories
+    if directories is None:
+        directories = find_measurement_directories(var_locations.measured_directory, required_logs)
+    if len(directories) == 0:
+        print(f"no measurement directories with {', '.join(required_logs)} were found")
+        sys.exit()
+    workers = min(var_variables.batch_workers or os.cpu_count() or 1, len(directories))
+
+    for variable in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+        os.environ.setdefault(variable, '1')                        # one thread per process avoids oversubscription
+    os.environ.setdefault('MPLBACKEND', 'Agg')                      # workers only save figures
+    if pipeline == 'multi_hole' or (pipeline == 'scanner' and 'multi_hole' in var_variables.scanner_devices):
+        try:
+            warm_calibration_cache()
+        except OSError as error:                                    # e.g. a missing interpolation file
+            print(f"WARNING: the calibration cache was not prepared ({type(error).__name__}: {error}), "
+                  f"each run reports the problem in its own log")
+
+    print(f"processing {len(directories)} directories with the {pipeline} pipeline using {workers} processes")
+    batch_start, failures = time.time(), list()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_directory, directory, scripts, arguments, workers > 1)
+                   for directory in directories]
+        for future in as_completed(futures):
+            time_directory, wall_time, message, log_file = future.result()
+            status = 'ok' if message is None else 'FAILED'
+            print(f"{time_directory}: {status} after {wall_time:.1f} s (log: {log_file})")
+            if message is not None:
+                print(f"    {message}")
+                failures.append(time_directory)
+    print(f"processed {len(directories) - len(failures)} of {len(directories)} directories successfully "
+          f"in {time.time() - batch_start:.1f} s")
+    if len(failures) > 0:
+        print(f"failed directories: {', '.join(sorted(failures))}")
+        sys.exit(1)
+
+# end of code
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""This Python script generates synthetic scanner, density and printer logs of increasing length and times each
+processing stage of the multi-hole probe pipeline on them. The timings are exported as JSON and compared with the
+previous benchmark run, so that changes in performance become visible"""
+
+import shutil
+from func_import_export import *
+from func_benchmark import *
+import var_locations
+import var_variables
+
+benchmark_directory = var_locations.benchmark_directory
+calibration_input_file = var_locations.calibration_input_file
+calibration_cache_directory = var_locations.calibration_cache_directory
+
+sample_rate, density_rate = var_variables.benchmark_sample_rate, var_variables.benchmark_density_rate
+channels, grid = var_variables.benchmark_channels, var_variables.benchmark_grid
+repeats, seed = max(int(var_variables.benchmark_repeats), 1), var_variables.benchmark_seed
+interp_size_coarse, interp_size_fine = var_variables.interp_size_coarse, var_variables.interp_size_fine
+interpolation_method = var_variables.interpolation_method
+refinement_chunk_size = var_variables.refinement_chunk_size
+multi_hole_pressure_channels = var_variables.multi_hole_pressure_channels
+switch_y_and_z = var_variables.switch_y_and_z
+angle_workers = var_variables.benchmark_angle_workers
+durations = [float(argument) for argument in sys.argv[1:] if not argument.startswith('--')]
+if len(durations) == 0:
+    durations = var_variables.benchmark_durations
+
+os.makedirs(benchmark_directory, exist_ok=True)
+previous_results = find_previous_results(benchmark_directory)
+df_calibration = import_csv_pandas(calibration_input_file)
+surface = import_calibration_surface(calibration_input_file, interpolation_method, calibration_cache_directory)
+calibration_coarse = calibration_table_from_surface(surface, interp_size_coarse)
+calibration_fine = calibration_table_from_surface(surface, interp_size_fine)
+export_pressure = [f'c_p_local_{hole + 1}' for hole in range(len(multi_hole_pressure_channels))]
+exports = ['timestamp', 'epoch', 'time', 'yaw', 'pitch', 'density', 'temperature'] + export_pressure + [
+    'velocity_mag', 'velocity_x', 'velocity_y', 'velocity_z', 'closest_match']
+
+angle_pools = {workers: create_angle_pool(calibration_coarse, calibration_fine, workers) for workers in angle_workers}
+angle_pools = {workers: angle_pool for workers, angle_pool in angle_pools.items() if angle_pool is not None}
+results = {'environment': environment_summary(),
+           'parameters': {'durations': durations, 'sample_rate': sample_rate, 'density_rate': density_rate,
+                          'channels': channels, 'grid': grid, 'repeats': repeats, 'seed': seed,
+                          'interp_size_coarse': interp_size_coarse, 'interp_size_fine': interp_size_fine,
+                          'angle_workers': angle_workers},
+           'cases': list()}
+for duration in durations:
+    name = f'{duration:g}s_{sample_rate:g}Hz_{channels}ch_{grid[0]}x{grid[1]}'
+    directory = os.path.join(benchmark_directory, name)
+    n_samples, n_points = int(duration * sample_rate), grid[0] * grid[1]
+    print(f"benchmarking {name} ({n_samples} samples, {n_points} traverse points, best of {repeats})")
+    timer = StageTimer()
+    with timer.stage('generate_logs', n_samples):
+        logs = generate_measurement(directory, df_calibration, duration, sample_rate, channels, grid, density_rate,
+                                    seed)
+    cache_directory = os.path.join(directory, 'cache')
+    shutil.rmtree(cache_directory, ignore_errors=True)              # time the conversion of fresh logs
+    with timer.stage('ingest_surrey_logs', n_samples):
+        for log in ['pressure', 'density']:
+            ingest_surrey_log(logs[log], cache_directory)
+    for repeat in range(repeats):                                   # stages modify the frame, so start afresh
+        with timer.stage('combine_pressure_and_density_cached', n_samples):
+            combine_pressure_and_density(logs['pressure'], logs['density'], multi_hole_pressure_channels,
+                                         cache_directory=cache_directory)
+        with timer.stage('combine_pressure_and_density', n_samples):
+            df_experiment = combine_pressure_and_density(logs['pressure'], logs['density'],
+                                                         multi_hole_pressure_channels)
+        with timer.stage('log_printer_to_csv_new', n_points):
+            df_printer = log_printer_to_csv(df_experiment, logs['printer_new'])
+            df_printer.columns = pd.MultiIndex.from_tuples(df_printer.columns)  # as read back by the field stage
+        with timer.stage('log_printer_to_csv_old', n_points):
+            log_printer_to_csv(df_experiment, logs['printer_old'])
+        with timer.stage('calculate_dimensionless_pressure', n_samples):
+            calculate_dimensionless_pressure(df_experiment)
+        with timer.stage('calculate_pitch_and_yaw', n_samples):
+            calculate_pitch_and_yaw(df_experiment, calibration_coarse)
+        with timer.stage('enhance_pitch_and_yaw', n_samples):
+            enhance_pitch_and_yaw(df_experiment, calibration_fine, refinement_chunk_size)
+        for workers, angle_pool in angle_pools.items():              # coarse lookup and refinement together
+            with timer.stage(f'calculate_pitch_and_yaw_parallel_{workers}', n_samples):
+                calculate_pitch_and_yaw_parallel(df_experiment, calibration_coarse, calibration_fine, angle_pool,
+                                                 refinement_chunk_size)
+        with timer.stage('calculate_velocity_components', n_samples):
+            calculate_velocity_components(df_experiment, switch_y_and_z)
+        with timer.stage('filter_multi_hole_probe_field', n_samples):
+            df_processed = filter_multi_hole_probe_field(df_experiment, df_printer)
+        with timer.stage('export_data_csv', n_samples):
+            export_data_csv(df_experiment[exports], os.path.join(directory, f'measured_multi_hole_probe_{name}.csv'))
+
+    for stage, timing in timer.stages.items():
+        print(f"    {stage:<38}{timing['seconds']:>9.3f} s {timing['rows_per_second']:>14.0f} rows/s "
+              f"{str(timing['peak_rss_mb']):>9} MB")
+    velocity = np.array(df_processed['velocity_mag_avg']).flatten()
+    results['cases'].append({'name': name, 'duration': duration, 'samples': n_samples, 'points': n_points,
+                             'log_bytes': {log: os.path.getsize(location) for log, location in logs.items()},
+                             'points_with_samples': int(np.isfinite(velocity).sum()),
+                             'velocity_mag_mean': float(np.nanmean(velocity)), 'stages': timer.stages})
+
+for angle_pool in angle_pools.values():
+    angle_pool.shutdown()
+results_file = export_benchmark_results(results, benchmark_directory)
+if previous_results is not None:
+    regressions = compare_benchmark_results(results, previous_results)
+    print(f"{len(regressions)} stages are slower than in the previous benchmark run")
+
+# end of code
@@ -36,5 +36,7 @@ for file in files:
             f.unlink()
         except OSError as error:
             print("Error: %s : %s" % (f, error.strerror))
+for cache in Path(f'{measured_directory}/').glob(f'*/{Path(var_locations.log_cache_directory).name}'):
+    shutil.rmtree(cache, ignore_errors=True)                       # binary copies of the raw logs
 
 # end of code
@@ -8,6 +8,8 @@ from func_graphs import *
 import var_locations
 import var_variables
 
+start_run('multi_hole_field', var_variables.progress_interval)     # time and memory of each stage
+
 # Specify file and directory names and base parameters
 time_directory = var_locations.time_directory
 processed_directory = var_locations.processed_directory
@@ -16,6 +18,7 @@ multi_hole_input_printer = var_locations.multi_hole_input_printer
 multi_hole_input_field = var_locations.multi_hole_input_field
 multi_hole_points = var_locations.multi_hole_points
 multi_hole_field = var_locations.multi_hole_field
+multi_hole_processed = var_locations.multi_hole_processed
 flip_x, flip_y = var_variables.flip_x, var_variables.flip_y
 
 no_edges = var_variables.no_edges
@@ -25,33 +28,50 @@ multi_hole_export_average = var_variables.multi_hole_export_average
 multi_hole_export_graph = var_variables.multi_hole_export_graph
 pitot_rake_export_limits = var_variables.pitot_rake_export_limits
 glyph, scat, heat, cont = var_variables.mh_glyph, var_variables.mh_scat, var_variables.mh_heat, var_variables.mh_cont
+intermediate_format = var_variables.intermediate_format
+export_compress = var_variables.export_compress
+figure_workers, figure_dpi = var_variables.figure_workers, var_variables.figure_dpi
+figure_format = var_variables.figure_format
+field_variables = ['epoch', 'yaw', 'pitch', 'density', 'temperature', 'velocity_mag', 'velocity_x', 'velocity_y',
+                   'velocity_z', 'closest_match']
 
 create_new_directory(processed_directory)
 create_new_directory(experimental_directory)
 
-df_measurements = import_csv_pandas(multi_hole_input_field)
-df_printer = import_csv_pandas(multi_hole_input_printer)
-if flip_x is True:
-    df_printer['probe_x'] = flip_coordinates(np.array(df_printer['probe_x']))
-if flip_y is True:
-    df_printer['probe_y'] = flip_coordinates(np.array(df_printer['probe_y']))
-probe_x, probe_y = np.array(df_printer['probe_x']), np.array(df_printer['probe_y'])
-
+field_inputs = [intermediate_file(multi_hole_input_field, intermediate_format, export_compress),
+                intermediate_file(multi_hole_input_printer, intermediate_format)]
+field_outputs = [multi_hole_points, multi_hole_field, intermediate_file(multi_hole_processed, intermediate_format)]
+field_parameters = stage_parameters(var_variables, [
+    'flip_x', 'flip_y', 'no_edges', 'no_corners_1', 'no_corners_3', 'multi_hole_export_field',
+    'multi_hole_export_average', 'intermediate_format'])
+if stage_is_current(experimental_directory, 'multi_hole_field', field_inputs, field_parameters, field_outputs):
+    df_processed = import_intermediate(multi_hole_processed, None, intermediate_format)
+else:
+    df_measurements = import_intermediate(multi_hole_input_field, field_variables, intermediate_format)
+    df_printer = import_intermediate(multi_hole_input_printer, None, intermediate_format)
+    if flip_x is True:
+        df_printer['probe_x'] = flip_coordinates(np.array(df_printer['probe_x']))
+    if flip_y is True:
+        df_printer['probe_y'] = flip_coordinates(np.array(df_printer['probe_y']))
+    probe_x, probe_y = np.array(df_printer['probe_x']), np.array(df_printer['probe_y'])
 
-df_processed = filter_multi_hole_probe_field(df_measurements, df_printer)
-df_field = calculate_average_field_values(df_processed)
-df_export = df_processed[multi_hole_export_field].copy()
-export_data_csv(df_export, multi_hole_points)
-df_export = df_field[multi_hole_export_average].copy()
-export_data_csv(df_export, multi_hole_field)
+    df_processed = filter_multi_hole_probe_field(df_measurements, df_printer)
+    df_field = calculate_average_field_values(df_processed)
+    df_export = df_processed[multi_hole_export_field].copy()
+    export_data_csv(df_export, multi_hole_points)
+    df_export = df_field[multi_hole_export_average].copy()
+    export_data_csv(df_export, multi_hole_field)
 
+    if no_edges is True or no_corners_1 is True or no_corners_3 is True:
+        ignore_indices = find_corner_and_edge_indices(df_printer, no_edges, no_corners_1, no_corners_3)
+        df_processed_trimmed = remove_indices_from_measurements(df_processed, ignore_indices)
+        df_field_trimmed = calculate_average_field_values(df_processed_trimmed)
 
-if no_edges is True or no_corners_1 is True or no_corners_3 is True:
-    ignore_indices = find_corner_and_edge_indices(df_printer, no_edges, no_corners_1, no_corners_3)
-    df_processed_trimmed = remove_indices_from_measurements(df_processed, ignore_indices)
-    df_field_trimmed = calculate_average_field_values(df_processed_trimmed)
+    export_intermediate(df_processed, multi_hole_processed, intermediate_format)    # input of the plotting stage
+    record_stage(experimental_directory, 'multi_hole_field', field_inputs, field_parameters, field_outputs)
 
 
+figures = list()
 df_graph = GraphBundle(np.array(df_processed['probe_x']), np.array(df_processed['probe_y']))
 df_graph.normalise = var_variables.multi_hole_normalise
 df_graph.norm_factor = var_variables.multi_hole_norm_factor
@@ -69,13 +89,13 @@ for array_name, plot_limits in zip(multi_hole_export_graph, pitot_rake_export_li
     graph_labels(df_graph, array_name, None)
     if heat:
         file_name = str(f'{processed_directory}/{time_directory}/figure_heat_{array_name}_{time_directory}')
-        create_heat_map(df_graph, file_name)
+        figures.append(figure_job(df_graph, 'heat', file_name))
     if scat:
         file_name = str(f'{processed_directory}/{time_directory}/figure_scat_{array_name}_{time_directory}')
-        create_scatter_plot(df_graph, file_name)
+        figures.append(figure_job(df_graph, 'scatter', file_name))
     if cont:
         file_name = str(f'{processed_directory}/{time_directory}/figure_cont_{array_name}_{time_directory}')
-        create_contour_plot(df_graph, file_name)
+        figures.append(figure_job(df_graph, 'contour', file_name))
 
 if glyph:
     df_graph.limits = [None, None]
@@ -87,6 +107,18 @@ if glyph:
     df_graph.data_pivot[df_graph.y_index, df_graph.x_index] = df_graph.data
     graph_labels(df_graph, 'velocity_x_avg', None)
     file_name = str(f'{processed_directory}/{time_directory}/figure_glyph_x_yz_{time_directory}')
-    create_glyph_plot(df_graph, file_name)
+    figures.append(figure_job(df_graph, 'glyph', file_name))
+
+plot_inputs = [intermediate_file(multi_hole_processed, intermediate_format)]
+plot_parameters = stage_parameters(var_variables, [
+    'multi_hole_normalise', 'multi_hole_norm_factor', 'multi_hole_norm_limits', 'multi_hole_export_graph',
+    'pitot_rake_export_limits', 'mh_glyph', 'mh_scat', 'mh_heat', 'mh_cont', 'figure_dpi', 'figure_format'])
+plot_outputs = figure_files(figures, figure_format)
+if not stage_is_current(experimental_directory, 'multi_hole_plot', plot_inputs, plot_parameters, plot_outputs):
+    render_figures(figures, figure_workers, figure_dpi, figure_format)
+    record_stage(experimental_directory, 'multi_hole_plot', plot_inputs, plot_parameters, plot_outputs)
+
+if var_variables.run_report is True:
+    export_run_report(experimental_directory, var_locations.time_directory)
 
 # end of code
@@ -6,6 +6,8 @@ from func_import_export import *
 import var_locations
 import var_variables
 
+start_run('multi_hole_time_frames', var_variables.progress_interval)     # time and memory of each stage
+
 processed_directory = var_locations.processed_directory
 experimental_directory = var_locations.experimental_directory
 multi_hole_input_points = var_locations.multi_hole_input_points
@@ -18,14 +20,28 @@ time_frame_names = var_variables.time_frame_names_probe
 mov_avg = var_variables.moving_average_span_probe
 labels = var_variables.labels_probe
 variables = var_variables.variables_probe
+intermediate_format = var_variables.intermediate_format
+export_compress = var_variables.export_compress
 
 create_new_directory(processed_directory)
 create_new_directory(experimental_directory)
-df_import = import_csv_pandas(multi_hole_input_points)
-df_std, df_smooth = filter_data_into_time_frames(df_import, time_frames, time_frame_names, mov_avg, labels, variables)
-df_avg = calculate_time_frame_averages(df_import, df_std, variables, time_frame_names, labels)
-export_data_csv(df_std, multi_hole_frames)
-export_data_csv(df_smooth, multi_hole_smoothed)
-export_data_csv(df_avg, multi_hole_averaged)
+
+frame_inputs = [intermediate_file(multi_hole_input_points, intermediate_format, export_compress)]
+frame_outputs = [multi_hole_frames, multi_hole_smoothed, multi_hole_averaged]
+frame_parameters = stage_parameters(var_variables, [
+    'time_frames_probe', 'time_frame_names_probe', 'moving_average_span_probe', 'labels_probe', 'variables_probe'])
+if not stage_is_current(experimental_directory, 'multi_hole_time_frames', frame_inputs, frame_parameters,
+                        frame_outputs):
+    df_import = import_intermediate(multi_hole_input_points, ['time'] + variables, intermediate_format)
+    df_std, df_smooth = filter_data_into_time_frames(df_import, time_frames, time_frame_names, mov_avg, labels,
+                                                     variables)
+    df_avg = calculate_time_frame_averages(df_import, df_std, variables, time_frame_names, labels)
+    export_data_csv(df_std, multi_hole_frames)
+    export_data_csv(df_smooth, multi_hole_smoothed)
+    export_data_csv(df_avg, multi_hole_averaged)
+    record_stage(experimental_directory, 'multi_hole_time_frames', frame_inputs, frame_parameters, frame_outputs)
+
+if var_variables.run_report is True:
+    export_run_report(experimental_directory, var_locations.time_directory)
 
 # end of code
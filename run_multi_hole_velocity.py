@@ -6,33 +6,102 @@ from func_import_export import *
 import var_locations
 import var_variables
 
+start_run('multi_hole_velocity', var_variables.progress_interval)     # time and memory of each stage
+
 pressure_input_log = var_locations.pressure_input_log
 density_input_log = var_locations.density_input_log
 printer_input_log = var_locations.printer_input_log
 printer_output = var_locations.printer_output
 multi_hole_output = var_locations.multi_hole_output
+experimental_directory = var_locations.experimental_directory
 interpolation_file_coarse = var_locations.interpolation_file_coarse
 interpolation_file_fine = var_locations.interpolation_file_fine
+calibration_input_file = var_locations.calibration_input_file
+calibration_cache_directory = var_locations.calibration_cache_directory
+log_cache_directory = var_locations.log_cache_directory if var_variables.log_cache is True else None
 
 switch_y_and_z = var_variables.switch_y_and_z
 multi_hole_pressure_channels = var_variables.multi_hole_pressure_channels
+angle_solver = var_variables.angle_solver
+interpolation_method = var_variables.interpolation_method
+refinement_chunk_size = var_variables.refinement_chunk_size
+surface_iterations = var_variables.surface_iterations
+angle_workers = var_variables.angle_workers
+interp_size_coarse, interp_size_fine = var_variables.interp_size_coarse, var_variables.interp_size_fine
+streaming, streaming_chunk_size = var_variables.streaming, var_variables.streaming_chunk_size
+export_precision, export_compress = var_variables.export_precision, var_variables.export_compress
+intermediate_format = var_variables.intermediate_format
+export_timestamps = var_variables.export_timestamps
+density_alignment = var_variables.density_alignment
 
-df_experiment = combine_pressure_and_density(pressure_input_log, density_input_log, multi_hole_pressure_channels)
-df_interpolation_coarse = import_csv_pandas(interpolation_file_coarse)
-calculate_dimensionless_pressure(df_experiment)
-calculate_pitch_and_yaw(df_experiment, df_interpolation_coarse)
-df_interpolation_fine = import_csv_pandas(interpolation_file_fine)
-enhance_pitch_and_yaw(df_experiment, df_interpolation_fine)  # rerun calculations with initial result on finer grid
-calculate_velocity_components(df_experiment, switch_y_and_z)
-export_pressure = [f'c_p_local_{hole + 1}' for hole in range(len(multi_hole_pressure_channels))]
-exports_velocity = ['velocity_mag', 'velocity_x', 'velocity_y', 'velocity_z', 'closest_match']
-exports_additional = ['timestamp', 'epoch', 'time', 'yaw', 'pitch', 'density', 'temperature']
-df_export = df_experiment[exports_additional + export_pressure + exports_velocity].copy()
-export_data_csv(df_export, multi_hole_output)
+velocity_inputs = [pressure_input_log, density_input_log, calibration_input_file, interpolation_file_coarse]
+velocity_outputs = [intermediate_file(multi_hole_output, intermediate_format, export_compress)]
+velocity_parameters = stage_parameters(var_variables, [
+    'switch_y_and_z', 'multi_hole_pressure_channels', 'interp_size_coarse', 'interp_size_fine', 'angle_solver',
+    'surface_iterations', 'interpolation_method', 'export_precision', 'export_compress', 'intermediate_format',
+    'export_timestamps', 'density_alignment'])
+if angle_solver != 'surface':
+    velocity_inputs.append(interpolation_file_fine)
 if os.path.exists(printer_input_log):
-    df_printer = log_printer_to_csv(df_experiment, printer_input_log)
-    export_data_csv(df_printer, printer_output)
-else:
-    print('No input printer coordinate log was found')
+    velocity_inputs.append(printer_input_log)
+    velocity_outputs.append(intermediate_file(printer_output, intermediate_format))
+if not stage_is_current(experimental_directory, 'multi_hole_velocity', velocity_inputs, velocity_parameters,
+                        velocity_outputs):
+    calibration_coarse = import_calibration_table(interpolation_file_coarse, calibration_input_file,
+                                                  interp_size_coarse, calibration_cache_directory)
+    if angle_solver == 'surface':
+        calibration_fine = import_calibration_surface(calibration_input_file, interpolation_method,
+                                                      calibration_cache_directory)  # no fine table required
+    else:
+        calibration_fine = import_calibration_table(interpolation_file_fine, calibration_input_file,
+                                                    interp_size_fine, calibration_cache_directory)
+    angle_pool = create_angle_pool(calibration_coarse, calibration_fine, angle_workers)  # None runs it in turn
+    export_pressure = [f'c_p_local_{hole + 1}' for hole in range(len(multi_hole_pressure_channels))]
+    exports_velocity = ['velocity_mag', 'velocity_x', 'velocity_y', 'velocity_z', 'closest_match']
+    exports_additional = ['timestamp', 'epoch', 'time', 'yaw', 'pitch', 'density', 'temperature']
+    if export_timestamps is False:
+        exports_additional.remove('timestamp')
+    if streaming is True:   # process and export the logs chunk by chunk to limit memory use
+        df_chunks = combine_pressure_and_density_chunks(pressure_input_log, density_input_log,
+                                                        multi_hole_pressure_channels, streaming_chunk_size,
+                                                        timestamps=export_timestamps,
+                                                        cache_directory=log_cache_directory,
+                                                        alignment=density_alignment)
+        writer = IntermediateWriter(multi_hole_output, intermediate_format, export_precision, export_compress)
+        progress = ProgressReporter("processing scanner log", unit='samples')
+        df_first = None                                 # the first chunk gives the printer log its start time
+        for count, df_experiment in enumerate(df_chunks):
+            process_multi_hole_pressures(df_experiment, calibration_coarse, calibration_fine, switch_y_and_z,
+                                         refinement_chunk_size, surface_iterations, angle_pool)
+            writer.write(df_experiment[exports_additional + export_pressure + exports_velocity])
+            progress.update(df_experiment.shape[0])
+            if count == 0:
+                df_first = df_experiment
+        progress.close()
+        writer.close()
+        if df_first is None:
+            raise ValueError(f"no samples of {pressure_input_log} overlap with {density_input_log}")
+        df_experiment = df_first
+    else:
+        df_experiment = combine_pressure_and_density(pressure_input_log, density_input_log,
+                                                     multi_hole_pressure_channels, timestamps=export_timestamps,
+                                                     cache_directory=log_cache_directory, alignment=density_alignment)
+        process_multi_hole_pressures(df_experiment, calibration_coarse, calibration_fine, switch_y_and_z,
+                                     refinement_chunk_size, surface_iterations, angle_pool)
+        df_export = df_experiment[exports_additional + export_pressure + exports_velocity].copy()
+        export_intermediate(df_export, multi_hole_output, intermediate_format, export_precision, export_compress)
+    if angle_pool is not None:
+        angle_pool.shutdown()
+    if os.path.exists(printer_input_log):
+        df_printer = log_printer_to_csv(df_experiment, printer_input_log)
+        export_intermediate(df_printer, printer_output, intermediate_format)
+    else:
+        print('No input printer coordinate log was found')
+
+    record_stage(experimental_directory, 'multi_hole_velocity', velocity_inputs, velocity_parameters,
+                 velocity_outputs)
+
+if var_variables.run_report is True:
+    export_run_report(experimental_directory, var_locations.time_directory)
 
 # end of code
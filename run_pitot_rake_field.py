@@ -8,6 +8,8 @@ from func_graphs import *
 import var_locations
 import var_variables
 
+start_run('pitot_rake_field', var_variables.progress_interval)     # time and memory of each stage
+
 # Specify file and directory names and base parameters
 time_directory = var_locations.time_directory
 processed_directory = var_locations.processed_directory
@@ -16,6 +18,7 @@ pitot_rake_input_field = var_locations.pitot_rake_input_field
 pitot_rake_input_printer = var_locations.pitot_rake_input_printer
 pitot_rake_points = var_locations.pitot_rake_points
 pitot_rake_field = var_locations.pitot_rake_field
+pitot_rake_processed = var_locations.pitot_rake_processed
 pitot_rake_offsets = var_variables.pitot_rake_offsets
 offset_in_x = var_variables.offset_in_x
 flip_x, flip_y = var_variables.flip_x, var_variables.flip_y
@@ -27,33 +30,52 @@ pitot_rake_export_average = var_variables.pitot_rake_export_average
 pitot_rake_export_graph = var_variables.pitot_rake_export_graph
 pitot_rake_export_limits = var_variables.pitot_rake_export_limits
 scat, heat, cont = var_variables.pr_scat, var_variables.pr_heat, var_variables.pr_cont
+intermediate_format = var_variables.intermediate_format
+export_compress = var_variables.export_compress
+figure_workers, figure_dpi = var_variables.figure_workers, var_variables.figure_dpi
+figure_format = var_variables.figure_format
+field_variables = ['epoch'] + [f'{var}{idx}' for var in ['P', 'V'] for idx in range(len(pitot_rake_offsets))]
 
 create_new_directory(processed_directory)
 create_new_directory(experimental_directory)
-df_measurements = import_csv_pandas(pitot_rake_input_field)
-df_printer = import_csv_pandas(pitot_rake_input_printer)
-if flip_x is True:
-    df_printer['probe_x'] = flip_coordinates(np.array(df_printer['probe_x']))
-    if offset_in_x:
-        pitot_rake_offsets.reverse()
-if flip_y is True:
-    df_printer['probe_y'] = flip_coordinates(np.array(df_printer['probe_y']))
-    if not offset_in_x:
-        pitot_rake_offsets.reverse()
-probe_x, probe_y = np.array(df_printer['probe_x']), np.array(df_printer['probe_y'])
-df_processed = filter_pitot_rake_field(df_measurements, df_printer, pitot_rake_offsets, offset_in_x)
-df_field = calculate_average_field_values(df_processed)
 
-df_export = df_processed[pitot_rake_export_field].copy()
-export_data_csv(df_export, pitot_rake_points)
-df_export = df_field[pitot_rake_export_average].copy()
-export_data_csv(df_export, pitot_rake_field)
+field_inputs = [intermediate_file(pitot_rake_input_field, intermediate_format, export_compress),
+                intermediate_file(pitot_rake_input_printer, intermediate_format)]
+field_outputs = [pitot_rake_points, pitot_rake_field, intermediate_file(pitot_rake_processed, intermediate_format)]
+field_parameters = stage_parameters(var_variables, [
+    'flip_x', 'flip_y', 'no_edges', 'no_corners_1', 'no_corners_3', 'pitot_rake_offsets', 'offset_in_x',
+    'pitot_rake_export_field', 'pitot_rake_export_average', 'intermediate_format'])
+if stage_is_current(experimental_directory, 'pitot_rake_field', field_inputs, field_parameters, field_outputs):
+    df_processed = import_intermediate(pitot_rake_processed, None, intermediate_format)
+else:
+    df_measurements = import_intermediate(pitot_rake_input_field, field_variables, intermediate_format)
+    df_printer = import_intermediate(pitot_rake_input_printer, None, intermediate_format)
+    if flip_x is True:
+        df_printer['probe_x'] = flip_coordinates(np.array(df_printer['probe_x']))
+        if offset_in_x:
+            pitot_rake_offsets.reverse()
+    if flip_y is True:
+        df_printer['probe_y'] = flip_coordinates(np.array(df_printer['probe_y']))
+        if not offset_in_x:
+            pitot_rake_offsets.reverse()
+    probe_x, probe_y = np.array(df_printer['probe_x']), np.array(df_printer['probe_y'])
+    df_processed = filter_pitot_rake_field(df_measurements, df_printer, pitot_rake_offsets, offset_in_x)
+    df_field = calculate_average_field_values(df_processed)
+
+    df_export = df_processed[pitot_rake_export_field].copy()
+    export_data_csv(df_export, pitot_rake_points)
+    df_export = df_field[pitot_rake_export_average].copy()
+    export_data_csv(df_export, pitot_rake_field)
+
+    if no_edges is True or no_corners_1 is True or no_corners_3 is True:
+        ignore_indices = find_corner_and_edge_indices(df_printer, no_edges, no_corners_1, no_corners_3)
+        df_processed_trimmed = remove_indices_from_measurements(df_processed, ignore_indices)
+        df_field_trimmed = calculate_average_field_values(df_processed_trimmed)
 
-if no_edges is True or no_corners_1 is True or no_corners_3 is True:
-    ignore_indices = find_corner_and_edge_indices(df_printer, no_edges, no_corners_1, no_corners_3)
-    df_processed_trimmed = remove_indices_from_measurements(df_processed, ignore_indices)
-    df_field_trimmed = calculate_average_field_values(df_processed_trimmed)
+    export_intermediate(df_processed, pitot_rake_processed, intermediate_format)    # input of the plotting stage
+    record_stage(experimental_directory, 'pitot_rake_field', field_inputs, field_parameters, field_outputs)
 
+figures = list()
 df_graph = GraphBundle(np.array(df_processed['probe_x']), np.array(df_processed['probe_y']))
 df_graph.normalise = var_variables.pitot_normalise
 df_graph.norm_factor = var_variables.pitot_norm_factor
@@ -71,12 +93,24 @@ for array_name, plot_limits in zip(pitot_rake_export_graph, pitot_rake_export_li
     graph_labels(df_graph, array_name, None)
     if heat:
         file_name = str(f'{processed_directory}/{time_directory}/figure_heat_{array_name}_{time_directory}')
-        create_heat_map(df_graph, file_name)
+        figures.append(figure_job(df_graph, 'heat', file_name))
     if scat:
         file_name = str(f'{processed_directory}/{time_directory}/figure_scat_{array_name}_{time_directory}')
-        create_scatter_plot(df_graph, file_name)
+        figures.append(figure_job(df_graph, 'scatter', file_name))
     if cont:
         file_name = str(f'{processed_directory}/{time_directory}/figure_cont_{array_name}_{time_directory}')
-        create_contour_plot(df_graph, file_name)
+        figures.append(figure_job(df_graph, 'contour', file_name))
+
+plot_inputs = [intermediate_file(pitot_rake_processed, intermediate_format)]
+plot_parameters = stage_parameters(var_variables, [
+    'pitot_normalise', 'pitot_norm_factor', 'pitot_norm_limits', 'pitot_rake_export_graph',
+    'pitot_rake_export_limits', 'pr_scat', 'pr_heat', 'pr_cont', 'figure_dpi', 'figure_format'])
+plot_outputs = figure_files(figures, figure_format)
+if not stage_is_current(experimental_directory, 'pitot_rake_plot', plot_inputs, plot_parameters, plot_outputs):
+    render_figures(figures, figure_workers, figure_dpi, figure_format)
+    record_stage(experimental_directory, 'pitot_rake_plot', plot_inputs, plot_parameters, plot_outputs)
+
+if var_variables.run_report is True:
+    export_run_report(experimental_directory, var_locations.time_directory)
 
 # end of code
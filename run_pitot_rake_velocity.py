@@ -7,22 +7,51 @@ from func_import_export import *
 import var_locations
 import var_variables
 
+start_run('pitot_rake_velocity', var_variables.progress_interval)     # time and memory of each stage
+
 pressure_input_log = var_locations.pressure_input_log
 density_input_log = var_locations.density_input_log
+log_cache_directory = var_locations.log_cache_directory if var_variables.log_cache is True else None
 printer_input_log = var_locations.printer_input_log
 printer_output = var_locations.printer_output
 pitot_rake_output = var_locations.pitot_rake_output
+experimental_directory = var_locations.experimental_directory
 
 pitot_rake_channels = var_variables.pitot_rake_channels
-df_experiment = combine_pressure_and_density(pressure_input_log, density_input_log, pitot_rake_channels)
-pressure_names, velocity_names = calculate_pitot_rake_velocities(df_experiment, pitot_rake_channels)
-exports_additional = ['timestamp', 'epoch', 'time', 'density', 'temperature']
-df_export = df_experiment[exports_additional + pressure_names + velocity_names].copy()
-export_data_csv(df_export, pitot_rake_output)
+export_precision, export_compress = var_variables.export_precision, var_variables.export_compress
+intermediate_format = var_variables.intermediate_format
+export_timestamps = var_variables.export_timestamps
+density_alignment = var_variables.density_alignment
+
+velocity_inputs = [pressure_input_log, density_input_log]
+velocity_outputs = [intermediate_file(pitot_rake_output, intermediate_format, export_compress)]
+velocity_parameters = stage_parameters(var_variables, [
+    'pitot_rake_channels', 'export_precision', 'export_compress', 'intermediate_format', 'export_timestamps',
+    'density_alignment'])
 if os.path.exists(printer_input_log):
-    df_printer = log_printer_to_csv(df_experiment, printer_input_log)
-    export_data_csv(df_printer, printer_output)
-else:
-    print('No input printer coordinate log was found')
+    velocity_inputs.append(printer_input_log)
+    velocity_outputs.append(intermediate_file(printer_output, intermediate_format))
+if not stage_is_current(experimental_directory, 'pitot_rake_velocity', velocity_inputs, velocity_parameters,
+                        velocity_outputs):
+    df_experiment = combine_pressure_and_density(pressure_input_log, density_input_log, pitot_rake_channels,
+                                                 timestamps=export_timestamps, cache_directory=log_cache_directory,
+                                                 alignment=density_alignment)
+    pressure_names, velocity_names = calculate_pitot_rake_velocities(df_experiment, pitot_rake_channels)
+    exports_additional = ['timestamp', 'epoch', 'time', 'density', 'temperature']
+    if export_timestamps is False:
+        exports_additional.remove('timestamp')
+    df_export = df_experiment[exports_additional + pressure_names + velocity_names].copy()
+    export_intermediate(df_export, pitot_rake_output, intermediate_format, export_precision, export_compress)
+    if os.path.exists(printer_input_log):
+        df_printer = log_printer_to_csv(df_experiment, printer_input_log)
+        export_intermediate(df_printer, printer_output, intermediate_format)
+    else:
+        print('No input printer coordinate log was found')
+
+    record_stage(experimental_directory, 'pitot_rake_velocity', velocity_inputs, velocity_parameters,
+                 velocity_outputs)
+
+if var_variables.run_report is True:
+    export_run_report(experimental_directory, var_locations.time_directory)
 
 # end of code
@@ -7,11 +7,14 @@ import var_variables
 from func_import_export import *
 from func_data import *
 
+start_run('pressure_tap_time_frames', var_variables.progress_interval)     # time and memory of each stage
+
 time_directory = var_locations.time_directory
 processed_directory = var_locations.processed_directory
 experimental_directory = var_locations.experimental_directory
 pressure_input_log = var_locations.pressure_input_log
 density_input_log = var_locations.density_input_log
+log_cache_directory = var_locations.log_cache_directory if var_variables.log_cache is True else None
 tap_pressures_raw = var_locations.tap_pressures_raw
 tap_pressures_smoothed = var_locations.tap_pressures_smoothed
 tap_pressures_averaged = var_locations.tap_pressures_averaged
@@ -21,17 +24,31 @@ time_frames = var_variables.time_frames_tap
 time_frame_names = var_variables.time_frame_names_tap
 mov_avg = var_variables.moving_average_span_tap
 labels = var_variables.labels_tap
+density_alignment = var_variables.density_alignment
 
 channels = np.array([(index, name) for index, name in enumerate(sensor_list) if name is not None])
 ch_indices, ch_names = channels[:, 0], channels[:, 1]
 create_new_directory(processed_directory)
 create_new_directory(experimental_directory)
-df_import = combine_pressure_and_density(pressure_input_log, density_input_log, ch_indices, ch_names)
-var_to_unit = create_variable_to_unit_dictionary(df_import)
-df_std, df_smooth = filter_data_into_time_frames(df_import, time_frames, time_frame_names, mov_avg, labels, ch_names)
-df_avg = calculate_time_frame_averages(df_import, df_std, ch_names, time_frame_names, labels)
-export_data_csv(df_std, tap_pressures_raw)
-export_data_csv(df_smooth, tap_pressures_smoothed)
-export_data_csv(df_avg, tap_pressures_averaged)
+
+tap_inputs = [pressure_input_log, density_input_log]
+tap_outputs = [tap_pressures_raw, tap_pressures_smoothed, tap_pressures_averaged]
+tap_parameters = stage_parameters(var_variables, [
+    'sensor_list', 'time_frames_tap', 'time_frame_names_tap', 'moving_average_span_tap', 'labels_tap',
+    'density_alignment'])
+if not stage_is_current(experimental_directory, 'pressure_tap_time_frames', tap_inputs, tap_parameters, tap_outputs):
+    df_import = combine_pressure_and_density(pressure_input_log, density_input_log, ch_indices, ch_names,
+                                             cache_directory=log_cache_directory, alignment=density_alignment)
+    var_to_unit = create_variable_to_unit_dictionary(df_import)
+    df_std, df_smooth = filter_data_into_time_frames(df_import, time_frames, time_frame_names, mov_avg, labels,
+                                                     ch_names)
+    df_avg = calculate_time_frame_averages(df_import, df_std, ch_names, time_frame_names, labels)
+    export_data_csv(df_std, tap_pressures_raw)
+    export_data_csv(df_smooth, tap_pressures_smoothed)
+    export_data_csv(df_avg, tap_pressures_averaged)
+    record_stage(experimental_directory, 'pressure_tap_time_frames', tap_inputs, tap_parameters, tap_outputs)
+
+if var_variables.run_report is True:
+    export_run_report(experimental_directory, var_locations.time_directory)
 
 # end of code
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""This Python script processes all devices that were attached to the pressure scanner during one run. The scanner
+and density logs are read only once, and each device script then takes its channels from the shared columns"""
+
+import runpy
+import traceback
+from func_import_export import *
+import var_locations
+import var_variables
+
+pressure_input_log = var_locations.pressure_input_log
+density_input_log = var_locations.density_input_log
+log_cache_directory = var_locations.log_cache_directory if var_variables.log_cache is True else None
+scanner_devices = var_variables.scanner_devices
+
+devices = {'multi_hole': ('run_multi_hole_velocity.py', var_variables.multi_hole_pressure_channels),
+           'pitot_rake': ('run_pitot_rake_velocity.py', var_variables.pitot_rake_channels),
+           'pressure_taps': ('run_pressure_tap_time_frames.py',
+                             [index for index, name in enumerate(var_variables.sensor_list) if name is not None])}
+unknown = [device for device in scanner_devices if device not in devices]
+if len(unknown) > 0:
+    raise ValueError(f"unknown devices {', '.join(unknown)}, choose from {', '.join(devices)}")
+
+available = surrey_log_columns(pressure_input_log)                 # the first line names all channels
+runnable, failures = list(), list()
+for device in scanner_devices:
+    missing = [f'P{int(channel)} (Pa)' for channel in devices[device][1] if f'P{int(channel)} (Pa)' not in available]
+    if len(missing) > 0:                                            # the other devices are still processed
+        failures.append(f"{device} skipped as {pressure_input_log} has no column {', '.join(missing)}")
+    else:
+        runnable.append(device)
+
+channels = sorted(set(int(channel) for device in runnable for channel in devices[device][1]))
+print(f"sharing {len(channels)} scanner channels for {', '.join(runnable)} (read once when first needed)")
+share_surrey_log(pressure_input_log, ['t (s)'] + [f'P{channel} (Pa)' for channel in channels], log_cache_directory)
+share_surrey_log(density_input_log, ['t (s)', 'Density (kg/m^3)', 'Thermistor (degC)'], log_cache_directory)
+
+arguments = [argument for argument in sys.argv[1:] if argument.startswith('--')]
+try:
+    for device in runnable:
+        script = devices[device][0]
+        print(f"---------- {script} ----------")
+        sys.argv = [script] + arguments
+        try:
+            runpy.run_path(script, run_name='__main__')
+        except Exception as error:                                  # the other devices are still processed
+            traceback.print_exc()
+            failures.append(f"{device} failed with {type(error).__name__}: {error}")
+finally:
+    release_shared_logs()
+
+print(f"processed {len(scanner_devices) - len(failures)} of {len(scanner_devices)} devices reading at most once "
+      f"{pressure_input_log}")
+for failure in failures:
+    print(f"    {failure}")
+if len(failures) > 0:
+    sys.exit(1)
+
+# end of code
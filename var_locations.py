@@ -1,8 +1,9 @@
 """This Python control module specifies all required file locations and names for the run scripts"""
 
+import os
 
-# The general directories
-time_directory = str("20220212_2327")
+# The general directories (run_batch sets PRESSURE_TIME_DIRECTORY to process several measurements)
+time_directory = str(os.environ.get('PRESSURE_TIME_DIRECTORY', "20220212_2327"))
 calibration_directory = str('data_calibrated')
 measured_directory = str("data_measured")
 processed_directory = str("data_processed")
@@ -11,6 +12,7 @@ pressure_input_log = str(f'{measured_directory}/{time_directory}/log_pressure.tx
 density_input_log = str(f'{measured_directory}/{time_directory}/log_additional.txt')
 printer_input_log = str(f'{measured_directory}/{time_directory}/log_printer.txt')
 printer_output = str(f'{measured_directory}/{time_directory}/measured_printer_{time_directory}.csv')
+log_cache_directory = str(f'{measured_directory}/{time_directory}/cache/')  # binary columns of the raw logs
 
 
 # File locations to *INTERPOLATE* the initial calibration (run_interpolate)
@@ -24,12 +26,14 @@ interpolation_figure_directory = str('figures_interpolated/')
 multi_hole_output = str(f'{measured_directory}/{time_directory}/measured_multi_hole_probe_{time_directory}.csv')
 interpolation_file_coarse = str('data_interpolated/interpolation_1-00.csv')
 interpolation_file_fine = str('data_interpolated/interpolation_0-20.csv')
+calibration_cache_directory = str('data_interpolated/cache/')
 
 # File locations *ASSIGNING MULTI-HOLE VELOCITIES TO COORDINATES* based on probe location (run_multi_hole_field)
 multi_hole_input_printer = printer_output
 multi_hole_input_field = multi_hole_output
 multi_hole_points = str(f'{processed_directory}/{time_directory}/multi_hole_field_points_{time_directory}.csv')
 multi_hole_field = str(f'{processed_directory}/{time_directory}/multi_hole_field_average_{time_directory}.csv')
+multi_hole_processed = str(f'{processed_directory}/{time_directory}/multi_hole_field_processed_{time_directory}.csv')
 
 
 # File locations *ASSIGNING MULTI-HOLE VELOCITIES TO TIMEFRAMES* at single measured point (run_multi_hole_time_frames)
@@ -47,6 +51,7 @@ pitot_rake_input_printer = printer_output
 pitot_rake_input_field = pitot_rake_output
 pitot_rake_points = str(f'{processed_directory}/{time_directory}/pitot_rake_field_points_{time_directory}.csv')
 pitot_rake_field = str(f'{processed_directory}/{time_directory}/pitot_rake_field_average_{time_directory}.csv')
+pitot_rake_processed = str(f'{processed_directory}/{time_directory}/pitot_rake_field_processed_{time_directory}.csv')
 
 
 # File locations to *ASSIGN PRESSURE TAP READINGS* to specific time frames and locations (run_pressure_tap_time_frames)
@@ -54,4 +59,8 @@ tap_pressures_raw = str(f'{processed_directory}/{time_directory}/tap_pressure_ra
 tap_pressures_smoothed = str(f'{processed_directory}/{time_directory}/tap_pressure_smooth_{time_directory}.csv')
 tap_pressures_averaged = str(f'{processed_directory}/{time_directory}/tap_pressure_avg_{time_directory}.csv')
 
+
+# File locations to *BENCHMARK* the processing stages on synthetic logs (run_benchmark)
+benchmark_directory = str('data_benchmark')
+
 # end of code
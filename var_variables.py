@@ -1,9 +1,34 @@
 """This Python control module specifies all required input parameters for the run scripts"""
 
 
+# Parameters to *EXPORT* measured data (run_multi_hole_velocity, run_pitot_rake_velocity)
+export_precision = None     # significant digits of exported floating point values (None keeps full precision)
+export_compress = False     # gzip-compress the exported measurement files (adds .gz to the file names)
+intermediate_format = 'csv' # data handed between run scripts: 'csv' or the faster binary 'feather' and 'parquet'
+export_timestamps = True    # add a per-sample date and time column (False saves memory on long recordings)
+
+
+# Parameters to *IMPORT* raw scanner logs (run_multi_hole_velocity, run_pitot_rake_velocity, run_pressure_tap_*)
+log_cache = True            # convert each raw log once into binary columns, which later runs map from disk
+density_alignment = 'hold'  # density and temperature at each pressure sample: 'hold' last reading or 'linear'
+
+
+# Parameters to *RENDER FIGURES* (run_interpolate, run_multi_hole_field, run_pitot_rake_field)
+figure_workers = None       # number of processes rendering figures (None uses all available cores, 1 renders in turn)
+figure_dpi = 300            # resolution of the saved figures
+figure_format = None        # file format of the saved figures, e.g. 'pdf' or 'svg' (None saves png)
+
+
+# Parameters to *REPORT PROGRESS* of all run scripts
+progress_interval = 5.0     # seconds between progress messages of long loops (None silences them)
+run_report = True           # write the time and peak memory of each stage to run_report_<script>_<time>.json
+
+
 # Parameters to *INTERPOLATE* the initial calibration (run_interpolate)
 original_size = 3.0     # specify the calibration cell size in degrees
 interp_size = 1.0       # specify the interpolation cell size in degrees
+interpolation_method = 'cubic'  # 'cubic' or 'linear' interpolation between calibration points
+export_interpolation_table = True   # write the dense interpolated table (required when angle_solver = 'table')
 
 
 # Parameters to *MODIFY PRINTER COORDINATES*
@@ -16,6 +41,14 @@ no_corners_3 = False    # ignore the three points located in each corner
 # Parameters to *CONVERT MULTI-HOLE PRESSURES TO VELOCITIES* (run_multi_hole_velocity)
 switch_y_and_z = True
 multi_hole_pressure_channels = [0, 1, 2, 3, 4, 5, 6]
+interp_size_coarse = 1.0            # cell size of the coarse interpolation file in degrees
+interp_size_fine = 0.2              # cell size of the fine interpolation file in degrees
+angle_solver = 'table'              # 'table' (coarse and fine tables) or 'surface' (solve within coarse cells)
+refinement_chunk_size = 10000       # samples refined per batch on the fine grid (limits memory use)
+surface_iterations = 10             # solver iterations within each coarse cell when angle_solver = 'surface'
+angle_workers = None                # processes sharing the pitch and yaw lookup (None uses all cores, 1 runs in turn)
+streaming = False                   # process the scanner logs in chunks to limit memory use
+streaming_chunk_size = 100000       # samples per chunk when streaming
 
 # Parameters to *ASSIGN MULTI-HOLE VELOCITIES TO COORDINATES* based on location (run_multi_hole_field)
 multi_hole_export_field = ['probe_x', 'probe_y', 'yaw_avg', 'pitch_avg', 'velocity_mag_avg', 'velocity_x_avg',
@@ -71,4 +104,22 @@ sensor_list[21] = 'straight 3 upstream'
 sensor_list[22] = 'straight 4 upstream'
 sensor_list[23] = 'straight 4 downstream'
 
+# Parameters to *PROCESS SEVERAL DEVICES* attached to one scanner log, which is read only once (run_scanner_pipeline)
+scanner_devices = ['multi_hole', 'pitot_rake', 'pressure_taps']    # devices measured during the same run
+
+# Parameters to *PROCESS SEVERAL MEASUREMENT DIRECTORIES* in parallel (run_batch)
+batch_pipeline = 'multi_hole'       # 'multi_hole', 'pitot_rake', 'pressure_taps' or 'scanner' (or pass it first)
+batch_directories = None            # list of time directories to process (None processes all complete ones)
+batch_workers = None                # number of parallel processes (None uses all available cores)
+
+# Parameters to *BENCHMARK* the processing stages on synthetic logs (run_benchmark)
+benchmark_durations = [2400, 14400]     # recording length of each synthetic measurement in seconds (or pass them)
+benchmark_sample_rate = 50              # pressure samples per second
+benchmark_density_rate = 1              # density and temperature samples per second
+benchmark_channels = 16                 # pressure scanner channels, the first seven hold the multi-hole probe
+benchmark_grid = [13, 21]               # traverse points in x and z (each point needs more than 4 s)
+benchmark_repeats = 3                   # each stage keeps the fastest of several repeats
+benchmark_seed = 0                      # random seed of the synthetic pressures
+benchmark_angle_workers = [2, 4]        # process counts of the parallel pitch and yaw stage (scaling check)
+
 # end of code